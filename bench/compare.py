@@ -0,0 +1,33 @@
+import argparse
+import json
+
+# Prints the numbers of two bench/run_bench.py result files side by side
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files.')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--min-change', type=float, default=0.0, help='only show metrics that changed by at least this many percent')
+    args = parser.parse_args(argv)
+
+    with open(args.old, encoding='utf-8') as file:
+        old = dict(flatten({key: value for key, value in json.load(file).items() if key != 'settings'}))
+    with open(args.new, encoding='utf-8') as file:
+        new = dict(flatten({key: value for key, value in json.load(file).items() if key != 'settings'}))
+    width = max(len(name) for name in new) if new else 0
+    for name, value in new.items():
+        if name not in old:
+            continue
+        change = (value - old[name]) / old[name] * 100 if old[name] else 0.0
+        if abs(change) >= args.min_change:
+            print(f"{name:<{width}}  {old[name]:>12.3f}  {value:>12.3f}  {change:>+7.1f}%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Local stand-in for olx.pt serving the recorded fixtures. Result pages are the
+# category's listing fixture with its ad links made unique per page number, so
+# page 3 lists different ads than page 2. Like the live site, a page past the
+# last one repeats the last page, which is what ends the bike scraper.
+
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+categories = ('car', 'motorcycle', 'bike')
+
+_ad_link = re.compile(r'(/d/anuncio/[^"?#]+?)\.html')
+_pagination = re.compile(r'<ul class="pagination-list[^"]*">.*?</ul>', re.S)
+
+def load_fixture(category, kind):
+    with open(os.path.join(fixtures_dir, f"{category}_{kind}.html"), encoding='utf-8') as file:
+        return file.read()
+
+def category_of(path):
+    if 'motociclos' in path:
+        return 'motorcycle'
+    if 'bicicletas' in path:
+        return 'bike'
+    return 'car'
+
+class MockOlx:
+    def __init__(self, pages=10, latency=0.0, jitter=0.0, error_rate=0.0, past_last='repeat', seed=None):
+        # latency and jitter are in seconds; past_last is 'repeat', 'empty' or '404'
+        self.pages = pages
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.past_last = past_last
+        self.random = random.Random(seed)
+        self.listings = {category: load_fixture(category, 'listing') for category in categories}
+        self.ads = {category: load_fixture(category, 'ad').encode('utf-8') for category in categories}
+        # Ad links of every fixture, so an ad request is answered with the right category
+        self.ad_categories = {}
+        for category, listing in self.listings.items():
+            for link in _ad_link.findall(listing):
+                self.ad_categories[link.rsplit('/', 1)[-1]] = category
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'listing_pages': 0, 'ad_pages': 0, 'errors': 0, 'bytes': 0}
+
+    def count(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.counters[name] += amount
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def delay(self):
+        with self.lock:
+            delay = self.random.gauss(self.latency, self.jitter) if self.jitter else self.latency
+            failed = self.random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return failed
+
+    def listing_page(self, category, page, origin):
+        if page > self.pages:
+            if self.past_last == 'empty':
+                return '<!DOCTYPE html><html lang="pt"><body><div data-testid="listing-grid"></div></body></html>'
+            page = self.pages
+        pagination = ''.join(f'<li class="pagination-item"><a href="?page={number}">{number}</a></li>'
+                             for number in range(1, self.pages + 1))
+        html = _pagination.sub(lambda _: f'<ul class="pagination-list">{pagination}</ul>', self.listings[category])
+        html = _ad_link.sub(lambda match: f"{match.group(1)}-p{page}.html", html)
+        return html.replace('https://www.olx.pt', origin)
+
+    def ad_page(self, path):
+        name = re.sub(r'-p\d+\.html$', '', path.rsplit('/', 1)[-1])
+        category = self.ad_categories.get(name)
+        return self.ads[category] if category else None
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'MockOlx/1.0'
+    # Keep-alive, so reused connections can be measured like against olx.pt
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, body=b'', content_type='text/html; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.mock.count(requests=1, bytes=len(body))
+
+    def do_GET(self):
+        mock = self.server.mock
+        parts = urlsplit(self.path)
+        if parts.path == '/__stats':
+            return self.send(200, json.dumps(mock.stats()).encode('utf-8'), 'application/json')
+        if mock.delay():
+            mock.count(errors=1)
+            return self.send(503, b'Service Unavailable')
+        if parts.path.startswith('/d/'):
+            body = mock.ad_page(parts.path)
+            if body is None:
+                return self.send(404, b'Not Found')
+            mock.count(ad_pages=1)
+            return self.send(200, body)
+        page = int(parse_qs(parts.query).get('page', ['1'])[0])
+        if page > mock.pages and mock.past_last == '404':
+            return self.send(404, b'Not Found')
+        mock.count(listing_pages=1)
+        origin = f"http://{self.headers.get('Host', '%s:%d' % self.server.server_address[:2])}"
+        self.send(200, mock.listing_page(category_of(parts.path), page, origin).encode('utf-8'))
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections at the scrapers' concurrency,
+    # which shows up as one second stalls
+    request_queue_size = 128
+
+def start(port=0, **options):
+    # Runs a mock server in a daemon thread; returns the server and its base URL
+    server = Server(('127.0.0.1', port), Handler)
+    server.mock = MockOlx(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the OLX fixtures locally.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pages', type=int, default=10, help='result pages per search (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean response delay in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='standard deviation of the delay in milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 503')
+    parser.add_argument('--past-last', choices=('repeat', 'empty', '404'), default='repeat',
+                        help='what a page past the last one returns (default: the last page again, like olx.pt)')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    server = Server(('127.0.0.1', args.port), Handler)
+    server.mock = MockOlx(args.pages, args.latency / 1000, args.jitter / 1000, args.error_rate, args.past_last, args.seed)
+    print(f"Serving the fixtures on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import os
+import sys
+from urllib.parse import urljoin
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_dir))
+
+import olx_http
+import olx_parse
+import olx_car_scrapper
+import olx_motorcycle_scrapper
+import olx_bike_scrapper
+from mock_server import fixtures_dir
+
+# Replaces the fixtures with the first result page and its first ad of a
+# live search of each category. Run it when the OLX markup changes.
+
+searches = {
+    'car': (olx_car_scrapper, lambda: olx_car_scrapper.build_url('bmw', 1)),
+    'motorcycle': (olx_motorcycle_scrapper, lambda: olx_motorcycle_scrapper.build_url('honda', 1)),
+    'bike': (olx_bike_scrapper, lambda: olx_bike_scrapper.build_url(1, '', '')),
+}
+
+def save(category, kind, html):
+    path = os.path.join(fixtures_dir, f"{category}_{kind}.html")
+    with open(path, mode='w', encoding='utf-8') as file:
+        file.write(html)
+    print(f"Saved {path}")
+
+def main():
+    for category, (scraper, url) in searches.items():
+        response = olx_http.get(url())
+        response.raise_for_status()
+        cards = [card for card in olx_parse.read_cards(response.text)[0] if card.href]
+        if not cards:
+            print(f"No ads found on the {category} result page, keeping the old fixtures")
+            continue
+        ad = olx_http.get(urljoin(scraper.ad_base_url, cards[0].href))
+        ad.raise_for_status()
+        save(category, 'listing', response.text)
+        save(category, 'ad', ad.text)
+
+if __name__ == "__main__":
+    main()
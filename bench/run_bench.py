@@ -0,0 +1,356 @@
+import argparse
+import io
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from contextlib import redirect_stdout
+from datetime import datetime
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_dir))
+
+import olx_http
+import olx_cache
+import olx_parse
+import olx_throttle
+import olx_output
+import olx_store
+import olx_car_scrapper
+import olx_motorcycle_scrapper
+import olx_bike_scrapper
+from mock_server import load_fixture
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Benchmarks the scrapers offline: parsing of the fixtures, scrape_page and
+# whole searches against bench/mock_server.py running in its own process,
+# and the output writers. Results are written as JSON for bench/compare.py.
+
+scrapers = {'car': olx_car_scrapper, 'motorcycle': olx_motorcycle_scrapper, 'bike': olx_bike_scrapper}
+_state_script = re.compile(r'<script[^>]*>\s*' + re.escape(olx_parse.state_marker) + r'.*?</script>', re.S)
+
+def without_state(html):
+    # The page as the HTML fallback sees it
+    return _state_script.sub('', html)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summary(seconds):
+    # Milliseconds, as that is the scale of one page
+    return {
+        'count': len(seconds),
+        'mean_ms': 1000 * sum(seconds) / len(seconds) if seconds else None,
+        'p50_ms': 1000 * percentile(seconds, 0.5) if seconds else None,
+        'p99_ms': 1000 * percentile(seconds, 0.99) if seconds else None,
+    }
+
+def timed(func, repeat):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - started)
+    return summary(seconds)
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+class RequestTimer:
+    # Records the duration of every olx_http.get call, retries included
+    def __init__(self):
+        self.seconds = []
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.original = olx_http.get
+        olx_http.get = self.get
+        return self
+
+    def __exit__(self, *exc):
+        olx_http.get = self.original
+
+    def get(self, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self.original(url, **kwargs)
+        finally:
+            with self.lock:
+                self.seconds.append(time.perf_counter() - started)
+
+class MockServer:
+    # bench/mock_server.py in a child process, so it does not compete for our GIL
+    def __init__(self, pages, latency, jitter, error_rate):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(bench_dir, 'mock_server.py'), '--port', str(port), '--pages', str(pages),
+             '--latency', str(latency), '--jitter', str(jitter), '--error-rate', str(error_rate), '--seed', '1'],
+            stdout=subprocess.DEVNULL)
+        for _ in range(100):
+            try:
+                self.stats()
+                return
+            except OSError:
+                time.sleep(0.05)
+        self.close()
+        raise RuntimeError('The mock server did not start')
+
+    def stats(self):
+        with urllib.request.urlopen(self.url + '/__stats', timeout=5) as response:
+            return json.load(response)
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+def point_at(base):
+    olx_car_scrapper.base_url = base + '/carros-motos-e-barcos/carros/'
+    olx_motorcycle_scrapper.base_url = base + '/carros-motos-e-barcos/motociclos-scooters/'
+    olx_bike_scrapper.base_url = base + '/desporto-e-lazer/bicicletas/?'
+    for scraper in scrapers.values():
+        scraper.ad_base_url = base
+
+def bench_parse(repeat):
+    results = {}
+    for category, scraper in scrapers.items():
+        listing = load_fixture(category, 'listing')
+        ad = load_fixture(category, 'ad')
+        listing_html, ad_html = without_state(listing), without_state(ad)
+        results[category] = {
+            'listing_bytes': len(listing.encode('utf-8')),
+            'cards_json': timed(lambda: olx_parse.read_cards(listing), repeat),
+            'cards_html': timed(lambda: olx_parse.read_cards(listing_html), repeat),
+            'description_json': timed(lambda: olx_parse.read_description(ad, scraper.extract_description), repeat),
+            'extract_description': timed(lambda: scraper.extract_description(olx_parse.description_soup(ad_html)), repeat),
+        }
+    return results
+
+def scrape_one(category, url):
+    # Returns the listings scrape_page kept, whatever its signature
+    scraper = scrapers[category]
+    if category == 'car':
+        return scraper.scrape_page(url, scraper.ad_base_url)
+    return scraper.scrape_page(url, scraper.ad_base_url, set())[0]
+
+def page_url(category, page):
+    if category == 'car':
+        return olx_car_scrapper.build_url('bmw', page)
+    if category == 'motorcycle':
+        return olx_motorcycle_scrapper.build_url('honda', page)
+    return olx_bike_scrapper.build_url(page, '', '')
+
+def bench_scrape(server, pages):
+    results = {}
+    for category in scrapers:
+        before = server.stats()
+        page_seconds = []
+        listings = 0
+        with RequestTimer() as timer, redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            for page in range(1, pages + 1):
+                page_started = time.perf_counter()
+                listings += len(scrape_one(category, page_url(category, page)))
+                page_seconds.append(time.perf_counter() - page_started)
+            elapsed = time.perf_counter() - started
+        after = server.stats()
+        ads = after['ad_pages'] - before['ad_pages']
+        results[category] = {
+            'seconds': elapsed,
+            'pages_per_s': pages / elapsed,
+            'ads_per_s': ads / elapsed,
+            'listings': listings,
+            'page': summary(page_seconds),
+            'request': summary(timer.seconds),
+            'server_errors': after['errors'] - before['errors'],
+        }
+    return results
+
+def bench_crawl(server, pages, output_dir):
+    # Whole searches, asking for one page more than there is, so each
+    # scraper has to notice the end of the results on its own
+    results = {}
+    runs = {
+        'car': lambda prefix: olx_car_scrapper.run_search('bmw', requested_pages=pages + 1, output_prefix=prefix),
+        'motorcycle': lambda prefix: olx_motorcycle_scrapper.run_search('honda', requested_pages=pages + 1, output_prefix=prefix),
+        # The card filters drop every listing, which must not end the crawl early
+        'motorcycle_filtered': lambda prefix: olx_motorcycle_scrapper.run_search(
+            'honda', requested_pages=pages + 1, location_filter='No such place', output_prefix=prefix),
+        'bike': lambda prefix: olx_bike_scrapper.run_search(pages + 1, output_prefix=prefix),
+    }
+    for category, run in runs.items():
+        before = server.stats()
+        with redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            listings = run(os.path.join(output_dir, category))
+            elapsed = time.perf_counter() - started
+        after = server.stats()
+        fetched = after['listing_pages'] - before['listing_pages']
+        results[category] = {
+            'seconds': elapsed,
+            'listings': listings,
+            'result_pages': fetched,
+            'pages_per_s': fetched / elapsed,
+            'ads_per_s': (after['ad_pages'] - before['ad_pages']) / elapsed,
+            'requests': after['requests'] - before['requests'],
+            'megabytes': (after['bytes'] - before['bytes']) / (1024 * 1024),
+        }
+    return results
+
+def check_crawl(results, pages):
+    # Every search has to read all the result pages, whatever its filters kept
+    return [f"crawl {category} stopped after {result['result_pages']} of {pages} result pages"
+            for category, result in results.items() if result['result_pages'] < pages]
+
+def sample_records(count):
+    cards = olx_parse.read_cards(load_fixture('car', 'listing'))[0]
+    description = olx_parse.read_description(load_fixture('car', 'ad'), olx_car_scrapper.extract_description)[0]
+    for index in range(1, count + 1):
+        card = cards[index % len(cards)]
+        yield {'Index': index, 'Link': f"{card.href}?n={index}", 'Price': card.price,
+               'Location': card.location, 'Description': description}
+
+def bench_writers(count, output_dir):
+    results = {}
+    records = list(sample_records(count))
+    for name, sink_type in sorted(olx_output.sink_types.items()):
+        path = os.path.join(output_dir, f"writers.{name}")
+        with redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            sink = sink_type(path)
+            for record in records:
+                sink.write(record)
+            sink.close()
+            elapsed = time.perf_counter() - started
+        size = os.path.getsize(path)
+        results[name] = {'seconds': elapsed, 'records_per_s': count / elapsed, 'megabytes_per_s': size / (1024 * 1024) / elapsed}
+
+    # The spool and external sort the car and motorcycle scrapers write through
+    spool_path = os.path.join(output_dir, 'writers.partial.ndjson')
+    started = time.perf_counter()
+    spool = olx_output.open_spool(spool_path)
+    for record in records:
+        spool.write((olx_car_scrapper.price_to_number(record['Price']), record['Price'], record['Link'],
+                     record['Location'], record['Description']))
+    spool.close()
+    sorted_count = sum(1 for _ in olx_output.external_sort(spool_path, max(1, count // 4)))
+    elapsed = time.perf_counter() - started
+    olx_output.remove_spool(spool_path)
+    results['spool_and_sort'] = {'seconds': elapsed, 'records_per_s': sorted_count / elapsed}
+
+    # The listing store that replaces the spool, read back in price order
+    started = time.perf_counter()
+    store = olx_store.ListingStore('car', 'bench:writers')
+    for record in records:
+        store.add(record['Price'], record['Link'], record['Location'], record['Description'])
+    store.close()
+    sorted_count = sum(1 for _ in store.results())
+    elapsed = time.perf_counter() - started
+    results['listing_store'] = {'seconds': elapsed, 'records_per_s': sorted_count / elapsed}
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=bench_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the OLX scrapers against the local fixtures.')
+    parser.add_argument('--only', action='append', choices=('parse', 'scrape', 'crawl', 'writers'),
+                        help='run only this benchmark (can be repeated)')
+    parser.add_argument('--pages', type=int, default=5, help='result pages per search (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=50, help='runs of each parse benchmark (default: %(default)s)')
+    parser.add_argument('--records', type=int, default=20000, help='records for the writer benchmark (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=20.0, help='mean mock server delay in ms (default: %(default)s)')
+    parser.add_argument('--jitter', type=float, default=5.0, help='standard deviation of the delay in ms (default: %(default)s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 503')
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help='olx_throttle requests per second (default: off, so the ceiling does not hide the scrapers)')
+    parser.add_argument('--output', help='results file (default: bench/results/<date>-<time>.json)')
+    args = parser.parse_args(argv)
+    selected = args.only or ['parse', 'scrape', 'crawl', 'writers']
+
+    olx_cache.enabled = False
+    olx_throttle.rate_limit = args.rate_limit
+    report = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'html_parser': olx_parse.parser,
+        'settings': {name: value for name, value in vars(args).items() if name not in ('only', 'output')},
+    }
+    with tempfile.TemporaryDirectory() as output_dir:
+        olx_store.store_path = os.path.join(output_dir, 'olx_listings.sqlite3')
+        if 'parse' in selected:
+            print('Parsing the fixtures...')
+            report['parse'] = bench_parse(args.repeat)
+        if 'scrape' in selected or 'crawl' in selected:
+            server = MockServer(args.pages, args.latency, args.jitter, args.error_rate)
+            try:
+                point_at(server.url)
+                if 'scrape' in selected:
+                    print('Running scrape_page against the mock server...')
+                    report['scrape'] = bench_scrape(server, args.pages)
+                if 'crawl' in selected:
+                    print('Running whole searches against the mock server...')
+                    report['crawl'] = bench_crawl(server, args.pages, output_dir)
+            finally:
+                server.close()
+        if 'writers' in selected:
+            print('Writing records...')
+            report['writers'] = bench_writers(args.records, output_dir)
+        olx_store.close()
+    report['peak_rss_mb'] = peak_rss_mb()
+    report['http'] = olx_http.stats()
+
+    output = args.output or os.path.join(bench_dir, 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, mode='w', encoding='utf-8') as file:
+        json.dump(report, file, indent=4)
+    print_report(report)
+    print(f"Results have been written to {output}")
+    failures = check_crawl(report.get('crawl', {}), args.pages)
+    for failure in failures:
+        print(f"Check failed: {failure}")
+    return 1 if failures else 0
+
+def print_report(report):
+    for category, result in report.get('parse', {}).items():
+        print(f"parse {category}: cards {result['cards_json']['mean_ms']:.2f} ms (JSON) / {result['cards_html']['mean_ms']:.2f} ms (HTML), "
+              f"description {result['description_json']['mean_ms']:.2f} ms (JSON) / {result['extract_description']['mean_ms']:.2f} ms (HTML)")
+    for category, result in report.get('scrape', {}).items():
+        print(f"scrape_page {category}: {result['pages_per_s']:.1f} pages/s, {result['ads_per_s']:.1f} ads/s, "
+              f"page p50 {result['page']['p50_ms']:.0f} ms p99 {result['page']['p99_ms']:.0f} ms, "
+              f"request p50 {result['request']['p50_ms']:.0f} ms p99 {result['request']['p99_ms']:.0f} ms")
+    for category, result in report.get('crawl', {}).items():
+        print(f"crawl {category}: {result['result_pages']} pages, {result['listings']} listings in {result['seconds']:.2f} s "
+              f"({result['pages_per_s']:.1f} pages/s, {result['ads_per_s']:.1f} ads/s)")
+    for name, result in report.get('writers', {}).items():
+        print(f"writer {name}: {result['records_per_s']:.0f} records/s")
+    if report['peak_rss_mb'] is not None:
+        print(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+
+if __name__ == "__main__":
+    sys.exit(main())
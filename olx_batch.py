@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import olx_fetch
+import olx_http
+import olx_throttle
+import olx_metrics
+import olx_cache
+import olx_store
+import olx_parse
+import olx_pipeline
+import olx_car_scrapper
+import olx_motorcycle_scrapper
+import olx_bike_scrapper
+
+# Runs many searches from a JSON lines file in one process, e.g.
+# {"name": "bmw-320", "category": "car", "brand": "bmw", "model": "320", "pages": 5, "formats": "csv"}
+# {"name": "honda-cb", "category": "motorcycle", "brand": "honda", "year_from": 2015, "top_k": 20}
+# {"name": "btt", "category": "bike", "pages": 10, "max_price": 800, "formats": "json"}
+# The searches share the HTTP connection pool, the description cache and the
+# in-flight deduplication of ad page fetches.
+
+categories = ('car', 'motorcycle', 'bike')
+
+def load_specs(path):
+    specs = []
+    with open(path, encoding='utf-8') as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                spec = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: {e}")
+            if spec.get('category') not in categories:
+                raise ValueError(f"{path}:{line_number}: category must be one of {', '.join(categories)}")
+            if spec['category'] != 'bike' and not spec.get('brand'):
+                raise ValueError(f"{path}:{line_number}: {spec['category']} searches need a brand")
+            for key in ('pages', 'top_k'):
+                if text(spec, key) and not text(spec, key).isdigit():
+                    raise ValueError(f"{path}:{line_number}: {key} must be a whole number")
+            spec.setdefault('name', f"{spec['category']}_{spec.get('brand', 'search')}_{line_number}")
+            specs.append(spec)
+    names = [spec['name'] for spec in specs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"{path}: search names must be unique, repeated: {', '.join(duplicates)}")
+    return specs
+
+def text(spec, key):
+    value = spec.get(key)
+    return '' if value is None else str(value).strip()
+
+def integer(spec, key):
+    value = text(spec, key)
+    return int(value) if value else None
+
+def run_spec(spec, output_dir):
+    prefix = os.path.join(output_dir, spec['name'])
+    options = {
+        'output_formats': spec.get('formats', 'csv'),
+        'incremental_mode': bool(spec.get('incremental')),
+        'output_prefix': prefix,
+        'delta_file': f"{prefix}_delta.json",
+    }
+    if spec['category'] == 'bike':
+        return olx_bike_scrapper.run_search(integer(spec, 'pages') or 25, text(spec, 'min_price'), text(spec, 'max_price'), **options)
+    if spec['category'] == 'car':
+        return olx_car_scrapper.run_search(
+            spec['brand'].lower().strip(), text(spec, 'model'), text(spec, 'year_from'), text(spec, 'year_to'),
+            integer(spec, 'pages') or 25, min_price=text(spec, 'min_price'), max_price=text(spec, 'max_price'),
+            location_filter=text(spec, 'location'), top_k=integer(spec, 'top_k'),
+            split_by_price=bool(spec.get('split_by_price')), **options)
+    return olx_motorcycle_scrapper.run_search(
+        spec['brand'].lower().strip(), text(spec, 'model'), text(spec, 'year_from'), text(spec, 'year_to'),
+        integer(spec, 'pages') or 25, min_price=text(spec, 'min_price'), max_price=text(spec, 'max_price'),
+        location_filter=text(spec, 'location'), top_k=integer(spec, 'top_k'), **options)
+
+def timed_run(spec, output_dir):
+    started = time.perf_counter()
+    try:
+        listings, error = run_spec(spec, output_dir), None
+    except Exception as e:
+        listings, error = 0, f"{type(e).__name__}: {e}"
+    return spec, listings, time.perf_counter() - started, error
+
+def print_summary(results, elapsed):
+    width = max([len(spec['name']) for spec, _, _, _ in results] + [6])
+    print(f"\n{'Search':<{width}}  {'Category':<10}  {'Listings':>8}  {'Seconds':>8}")
+    for spec, listings, seconds, error in results:
+        line = f"{spec['name']:<{width}}  {spec['category']:<10}  {listings:>8}  {seconds:>8.1f}"
+        print(f"{line}  {error}" if error else line)
+    print(f"{len(results)} searches finished in {elapsed:.1f} seconds")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run many OLX searches from a JSON lines file.')
+    parser.add_argument('specs', help='file with one JSON search per line')
+    parser.add_argument('--output-dir', default='.', help='directory for the output files (default: current directory)')
+    parser.add_argument('--parallel', type=int, default=olx_fetch.parallel_searches, help='searches run at the same time')
+    parser.add_argument('--parse-processes', type=int, default=0, help='parser processes (default: parse in the fetch threads)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every throttle decision')
+    args = parser.parse_args(argv)
+    olx_throttle.configure_logging(args.verbose)
+
+    try:
+        specs = load_specs(args.specs)
+    except (IOError, ValueError) as e:
+        parser.error(str(e))
+    os.makedirs(args.output_dir, exist_ok=True)
+    # Sizes the shared connection pool, so it has to be set before the first request
+    olx_fetch.parallel_searches = max(1, args.parallel)
+    olx_pipeline.start(args.parse_processes)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=olx_fetch.parallel_searches) as executor:
+        results = list(executor.map(lambda spec: timed_run(spec, args.output_dir), specs))
+    print_summary(results, time.perf_counter() - started)
+
+    olx_http.print_stats()
+    olx_throttle.print_stats()
+    olx_cache.print_stats()
+    olx_parse.print_stats()
+    olx_metrics.print_stats()
+    # One report for the whole batch, next to its outputs
+    olx_metrics.export(os.path.join(args.output_dir, olx_metrics.report_path) if olx_metrics.report_path else None,
+                       os.path.join(args.output_dir, olx_metrics.textfile_path) if olx_metrics.textfile_path else None)
+    olx_cache.close()
+    olx_store.close()
+    olx_pipeline.stop()
+    return 1 if any(error for _, _, _, error in results) else 0
+
+if __name__ == "__main__":
+    with olx_metrics.profile():
+        status = main()
+    sys.exit(status)
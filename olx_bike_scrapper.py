@@ -1,21 +1,36 @@
 import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urlencode, urljoin
-import csv
-import json
+from contextlib import closing
+from olx_fetch import map_in_order, prefetch_pages, detail_workers
+import olx_http
+import olx_throttle
+import olx_metrics
+import olx_cache
+import olx_seen
+import olx_store
+import olx_parse
+import olx_pipeline
+from olx_filters import FilterPipeline, price_between, description_excludes
+from olx_output import parse_formats, open_sinks, write_record, flush_sinks, close_sinks
 
 # Base URL for bike listings
 base_url = 'https://www.olx.pt/desporto-e-lazer/bicicletas/?'
 # Base URL for the ad details
 ad_base_url = 'https://www.olx.pt'
+# Listings whose description contains any of these are dropped
+description_exclusions = ['26']
 
 def get_user_inputs():
     requested_pages = int(input("Enter the number of pages to scrape: ").strip())
     min_price = input("Enter the minimum price threshold (leave blank for no minimum): ").strip()
     max_price = input("Enter the maximum price threshold (leave blank for no maximum): ").strip()
-    output_formats = input("Enter the desired output formats (csv, json, or both): ").strip().lower()
-    return requested_pages, min_price, max_price, output_formats
+    output_formats = input("Enter the desired output formats (csv, json, ndjson, or both): ").strip().lower()
+    incremental = input("Only fetch new or changed listings since the last run? (y/N): ").strip().lower() == 'y'
+    parse_processes = input("Number of parser processes (or press Enter to parse in the fetch threads): ").strip()
+    parse_processes = int(parse_processes) if parse_processes else 0
+    return requested_pages, min_price, max_price, output_formats, incremental, parse_processes
 
+@olx_metrics.timed('format_location')
 def format_location(location_str):
     location_str = location_str.strip()
     dash_index = location_str.find('-')
@@ -33,76 +48,83 @@ def extract_description(soup):
         return description
     return 'No description available'
 
-def scrape_page(url, ad_base_url, processed_urls):
+def parse_description(response):
+    return olx_pipeline.parse_description(response, extract_description)
+
+def fetch_description(href):
+    # A failed ad page only costs its own listing, not the rest of the result page
+    try:
+        description = olx_cache.cached_description(href, parse_description)
+    except requests.exceptions.RequestException as e:
+        print(f"Error accessing ad URL {href}: {e}")
+        return None
+    if description is None:
+        print(f"Error accessing ad URL: {href}")
+    return description
+
+def fetch_result_page(url):
+    with olx_metrics.span('result_page_fetch'):
+        return olx_http.get(url)
+
+def scrape_page(url, ad_base_url, processed_urls, max_workers=detail_workers, fetch=None, incremental=None, filters=None):
     all_valid_listings = []
+    if filters is None:
+        filters = make_filters()
     try:
-        response = requests.get(url)
+        response = fetch() if fetch else fetch_result_page(url)
         response.raise_for_status()  # Raise an error if the URL is not valid
-        soup = BeautifulSoup(response.text, 'html.parser')
-        ad_containers = soup.find_all('div', {'data-cy': 'l-card'})
+        ad_containers = olx_pipeline.parse_cards(response)
         
         if not ad_containers:
             print(f"No ads found on page: {url}")
             return all_valid_listings, True  # Indicate no new content
 
         found_duplicate = False
+        cards = []
         for ad in ad_containers:
-            link_tag = ad.find('a', class_='css-z3gu2d', href=True)
-            if link_tag:
-                relative_href = link_tag['href']
-                href = urljoin(ad_base_url, relative_href)
+            if ad.href:
+                href = urljoin(ad_base_url, ad.href)
 
                 if href in processed_urls:
                     print(f"Duplicate found: {href}")
                     found_duplicate = True
+                    olx_metrics.count('listings_dropped', rule='duplicate')
                     continue  # Skip if this URL has already been processed
 
                 processed_urls.add(href)
 
-                price_tag = ad.find('p', {'data-testid': 'ad-price'})
-                price = price_tag.get_text(strip=True) if price_tag else 'Price not found'
-                
-                location_tag = ad.find('p', {'data-testid': 'location-date'})
-                location = format_location(location_tag.get_text(strip=True)) if location_tag else 'Location not found'
+                price = ad.price if ad.price is not None else 'Price not found'
                 
-                ad_response = requests.get(href)
-                if ad_response.status_code == 200:
-                    soup_ad = BeautifulSoup(ad_response.text, 'html.parser')
-                    description = extract_description(soup_ad)
-                    
-                    # Filter out listings where the description contains "26"
-                    if "26" not in description:
-                        all_valid_listings.append((price, href, location, description))
-                else:
-                    print(f"Error accessing ad URL: {href}")
+                location = format_location(ad.location) if ad.location is not None else 'Location not found'
+                # In incremental mode, unchanged listings from earlier runs are skipped. This comes
+                # before the filters so that every listing on the page counts as seen
+                if incremental and not incremental.classify(href, price):
+                    olx_metrics.count('listings_dropped', rule='unchanged')
+                    continue
+                if not filters.accept_card(price, location, ad.title):
+                    continue
+                cards.append((price, href, location))
+
+        # Fetch the ad pages of this result page concurrently
+        descriptions = map_in_order(fetch_description, [card[1] for card in cards], max_workers)
+        for (price, href, location), description in zip(cards, descriptions):
+            if description is None:
+                if incremental:
+                    incremental.fetch_failed(href)
+                continue
+            # Filter out listings by description, e.g. the ones that contain "26"
+            if filters.accept_description(description):
+                all_valid_listings.append((price, href, location, description))
         
         return all_valid_listings, found_duplicate
     except requests.exceptions.RequestException as e:
         print(f"Error accessing {url}: {e}")
         return [], False
 
-def write_to_csv(listings):
-    csv_file = 'bike_listings.csv'
-    try:
-        with open(csv_file, mode='w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(['Index', 'Link', 'Price', 'Location', 'Description'])
-            for index, (price, link, location, description) in enumerate(listings):
-                writer.writerow([index + 1, link, price, location, description])
-        print(f"Results have been written to {csv_file}")
-    except IOError as e:
-        print(f"Failed to write CSV file. Error: {e}")
-
-def write_to_json(listings):
-    json_file = 'bike_listings.json'
-    try:
-        with open(json_file, mode='w', encoding='utf-8') as file:
-            listings_dict = [{'Index': index + 1, 'Link': link, 'Price': price, 'Location': location, 'Description': description} 
-                             for index, (price, link, location, description) in enumerate(listings)]
-            json.dump(listings_dict, file, ensure_ascii=False, indent=4)
-        print(f"Results have been written to {json_file}")
-    except IOError as e:
-        print(f"Failed to write JSON file. Error: {e}")
+def make_filters(min_price='', max_price=''):
+    # Price bounds are checked on the card, before the ad page is requested
+    card_rules = [price_between(min_price, max_price)] if min_price or max_price else []
+    return FilterPipeline(card_rules, [description_excludes(text) for text in description_exclusions])
 
 def build_url(page, min_price, max_price):
     params = {
@@ -118,38 +140,79 @@ def build_url(page, min_price, max_price):
     url = base_url + urlencode(params)
     return url
 
-def main():
-    requested_pages, min_price, max_price, output_formats = get_user_inputs()
+@olx_metrics.timed('search')
+def run_search(requested_pages, min_price='', max_price='', output_formats='csv', incremental_mode=False, output_prefix='bike_listings', delta_file=None):
+    # Runs one search without asking anything; returns the number of listings written
 
-    all_valid_listings = []
+    # Listings are written as soon as they are scraped
+    sinks = [olx_pipeline.writer(sink) for sink in open_sinks(output_prefix, parse_formats(output_formats))]
+    total_listings = 0
     processed_urls = set()  # Track processed URLs to avoid duplicates
-
-    for page in range(1, requested_pages + 1):
-        url = build_url(page, min_price, max_price)
-        print(f"Scraping page {page}: {url}")
-        
-        valid_listings, found_duplicate = scrape_page(url, ad_base_url, processed_urls)
-        all_valid_listings.extend(valid_listings)
-        
-        if found_duplicate:
-            print(f"Stopping further scraping due to duplicates found on page {page}.")
-            break
+    filters = make_filters(min_price, max_price)
+
+    page_urls = [build_url(page, min_price, max_price) for page in range(1, requested_pages + 1)]
+    # Built from page 1 even when no page is requested
+    key = olx_seen.search_key('bike', build_url(1, min_price, max_price))
+    incremental = olx_seen.IncrementalRun(key) if incremental_mode else None
+    store = olx_store.ListingStore('bike', key) if olx_store.enabled else None
+    complete = False
+
+    # The next result pages download while the current page's ads are fetched
+    with closing(prefetch_pages(page_urls, fetch_result_page)) as pages:
+        for page, (url, future) in enumerate(pages, start=1):
+            print(f"Scraping page {page}: {url}")
+            
+            valid_listings, found_duplicate = scrape_page(url, ad_base_url, processed_urls, fetch=future.result, incremental=incremental, filters=filters)
+            with olx_metrics.span('write_outputs'):
+                for price, link, location, description in valid_listings:
+                    total_listings += 1
+                    record = {'Index': total_listings, 'Link': link, 'Price': price, 'Location': location, 'Description': description}
+                    write_record(sinks, record)
+                    if store:
+                        store.add(price, link, location, description)
+                    if incremental:
+                        incremental.collect(record)
+                flush_sinks(sinks)
+                if store:
+                    store.flush()
+            
+            if found_duplicate:
+                print(f"Stopping further scraping due to duplicates found on page {page}.")
+                complete = True
+                break
     
-    # Save listings to output formats only once after scraping is complete
-    if 'csv' in output_formats:
-        write_to_csv(all_valid_listings)
+    with olx_metrics.span('write_outputs'):
+        close_sinks(sinks)
+        if store:
+            store.close()
     
-    if 'json' in output_formats:
-        write_to_json(all_valid_listings)
-
-    if "both" in output_formats:
-        write_to_csv(all_valid_listings)
-        write_to_json(all_valid_listings)
+    if incremental:
+        delta = incremental.finish(complete)
+        olx_seen.print_delta(delta)
+        olx_seen.write_delta(delta, delta_file or f"{output_prefix}_delta.json")
     
-    if not all_valid_listings:
+    if not total_listings:
         print(f"No valid listings found.")
     else:
-        print(f"Scraping completed with {len(all_valid_listings)} valid listings found.")
+        print(f"Scraping completed with {total_listings} valid listings found.")
+    filters.print_stats()
+    return total_listings
+
+def main():
+    requested_pages, min_price, max_price, output_formats, incremental_mode, parse_processes = get_user_inputs()
+    olx_throttle.configure_logging()
+    olx_pipeline.start(parse_processes)
+    run_search(requested_pages, min_price, max_price, output_formats, incremental_mode)
+    olx_http.print_stats()
+    olx_throttle.print_stats()
+    olx_cache.print_stats()
+    olx_parse.print_stats()
+    olx_metrics.print_stats()
+    olx_metrics.export()
+    olx_cache.close()
+    olx_store.close()
+    olx_pipeline.stop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with olx_metrics.profile():
+        main()
\ No newline at end of file
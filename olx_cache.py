@@ -0,0 +1,158 @@
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import olx_http
+import olx_metrics
+
+# On-disk cache of extracted ad descriptions, keyed by ad URL
+enabled = True
+cache_path = 'olx_cache.sqlite3'
+# Entries younger than this are used without contacting the server
+cache_ttl = 6 * 60 * 60
+# Least recently used entries are dropped once the descriptions exceed this size
+cache_max_bytes = 50 * 1024 * 1024
+# How many new entries are written between two size checks
+evict_every = 100
+
+_conn = None
+_lock = threading.Lock()
+_writes = 0
+# Descriptions being fetched right now, so concurrent searches fetch an ad once
+_inflight = {}
+counters = {'hits': 0, 'revalidated': 0, 'misses': 0, 'shared': 0}
+
+def get_connection():
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(cache_path, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS descriptions (
+            url TEXT PRIMARY KEY,
+            description TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            size INTEGER NOT NULL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS descriptions_accessed_at ON descriptions (accessed_at)')
+        _conn = conn
+    return _conn
+
+def count(name):
+    with _lock:
+        counters[name] += 1
+
+def lookup(url):
+    with _lock:
+        conn = get_connection()
+        row = conn.execute('SELECT description, etag, last_modified, fetched_at FROM descriptions WHERE url = ?', (url,)).fetchone()
+        if row:
+            conn.execute('UPDATE descriptions SET accessed_at = ? WHERE url = ?', (time.time(), url))
+    return row
+
+def refresh(url, fetched_at):
+    with _lock:
+        get_connection().execute('UPDATE descriptions SET fetched_at = ? WHERE url = ?', (fetched_at, url))
+
+def store(url, description, etag, last_modified, fetched_at):
+    global _writes
+    size = len(url) + len(description.encode('utf-8'))
+    with _lock:
+        get_connection().execute(
+            'INSERT OR REPLACE INTO descriptions (url, description, etag, last_modified, fetched_at, accessed_at, size) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (url, description, etag, last_modified, fetched_at, fetched_at, size))
+        _writes += 1
+        if _writes % evict_every == 0:
+            _evict()
+
+def _evict():
+    conn = get_connection()
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM descriptions').fetchone()[0]
+    if total <= cache_max_bytes:
+        return
+    stale = []
+    for url, size in conn.execute('SELECT url, size FROM descriptions ORDER BY accessed_at'):
+        if total <= cache_max_bytes:
+            break
+        stale.append((url,))
+        total -= size
+    conn.executemany('DELETE FROM descriptions WHERE url = ?', stale)
+
+def cached_description(url, parse):
+    # Returns the description of the ad at url, or None if the page could not be
+    # fetched; parse gets the response of a successful fetch
+    with _lock:
+        pending = _inflight.get(url)
+        owner = pending is None
+        if owner:
+            pending = _inflight[url] = Future()
+    if not owner:
+        count('shared')
+        return pending.result()
+    try:
+        description = _fetch_description(url, parse)
+    except BaseException as e:
+        pending.set_exception(e)
+        raise
+    else:
+        pending.set_result(description)
+        return description
+    finally:
+        with _lock:
+            del _inflight[url]
+
+def _fetch_description(url, parse):
+    if not enabled:
+        with olx_metrics.span('ad_page_fetch'):
+            response = olx_http.get(url)
+        return parse(response) if response.status_code == 200 else None
+    now = time.time()
+    row = lookup(url)
+    headers = {}
+    if row:
+        description, etag, last_modified, fetched_at = row
+        if now - fetched_at < cache_ttl:
+            count('hits')
+            return description
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+    with olx_metrics.span('ad_page_fetch'):
+        response = olx_http.get(url, headers=headers)
+    if headers and response.status_code == 304:
+        count('revalidated')
+        refresh(url, now)
+        return description
+    count('misses')
+    if response.status_code != 200:
+        return None
+    description = parse(response)
+    store(url, description, response.headers.get('ETag'), response.headers.get('Last-Modified'), now)
+    return description
+
+def stats():
+    with _lock:
+        result = dict(counters)
+    lookups = result['hits'] + result['revalidated'] + result['misses']
+    result['hit_rate'] = (result['hits'] + result['revalidated']) / lookups if lookups else 0.0
+    return result
+
+def print_stats():
+    if not enabled:
+        return
+    result = stats()
+    print(f"Cache: {result['hits']} hits, {result['revalidated']} revalidated, {result['misses']} misses "
+          f"(hit rate {result['hit_rate']:.0%}), {result['shared']} fetches shared with another search")
+
+def close():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _evict()
+            _conn.close()
+            _conn = None
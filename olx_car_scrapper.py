@@ -1,9 +1,21 @@
 import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urlencode, urljoin
 import re
-import csv
-import json
+from contextlib import closing
+from olx_fetch import map_in_order, prefetch_pages, detail_workers, parallel_searches, SeenSet
+import olx_http
+import olx_throttle
+import olx_metrics
+import olx_cache
+import olx_seen
+import olx_store
+from olx_topk import TopK
+from olx_filters import FilterPipeline, price_between, location_contains
+import olx_shards
+import olx_parse
+import olx_pipeline
+from olx_parse import make_soup
+from olx_output import parse_formats, open_sinks, open_spool, write_record, close_sinks, external_sort, remove_spool
 
 # Base URL for the car listings
 base_url = 'https://www.olx.pt/carros-motos-e-barcos/carros/'
@@ -16,9 +28,19 @@ def get_user_inputs():
     year_from = input("Enter the starting year (or press Enter to skip): ").strip()
     year_to = input("Enter the ending year (or press Enter to skip): ").strip()
     requested_pages = int(input("Enter the number of pages to scrape (max 25): ").strip())
-    output_formats = input("Enter the desired output formats (csv, json, or both): ").strip().lower()
-    return car_brand, car_model, year_from, year_to, requested_pages, output_formats
+    output_formats = input("Enter the desired output formats (csv, json, ndjson, or both): ").strip().lower()
+    incremental = input("Only fetch new or changed listings since the last run? (y/N): ").strip().lower() == 'y'
+    min_price = input("Enter the minimum price (or press Enter to skip): ").strip()
+    max_price = input("Enter the maximum price (or press Enter to skip): ").strip()
+    location = input("Only keep listings whose location contains (or press Enter to skip): ").strip()
+    top_k = input("Only keep the N cheapest listings (or press Enter to keep all): ").strip()
+    top_k = int(top_k) if top_k else None
+    split_by_price = input("Split the search into price ranges to get past the 25 page limit? (y/N): ").strip().lower() == 'y'
+    parse_processes = input("Number of parser processes (or press Enter to parse in the fetch threads): ").strip()
+    parse_processes = int(parse_processes) if parse_processes else 0
+    return car_brand, car_model, year_from, year_to, requested_pages, output_formats, incremental, min_price, max_price, location, top_k, split_by_price, parse_processes
 
+@olx_metrics.timed('price_to_number')
 def price_to_number(price_str):
     price_str = re.sub(r'[^\d,]', '', price_str)
     price_str = price_str.replace(',', '.')
@@ -27,6 +49,7 @@ def price_to_number(price_str):
     except ValueError:
         return float('inf')
 
+@olx_metrics.timed('format_location')
 def format_location(location_str):
     location_str = location_str.strip()
     dash_index = location_str.find('-')
@@ -44,6 +67,10 @@ def extract_description(soup):
         return description
     return 'No description available'
 
+def fetch_result_page(url):
+    with olx_metrics.span('result_page_fetch'):
+        return olx_http.get(url)
+
 def get_total_pages(soup):
     pagination = soup.find('ul', class_='pagination-list')
     if pagination:
@@ -63,53 +90,146 @@ def get_total_pages(soup):
             return int(match.group(1)) + 1
     return 1
 
-def scrape_page(url, ad_base_url):
+def parse_description(response):
+    return olx_pipeline.parse_description(response, extract_description)
+
+def fetch_description(href):
+    # None if the ad page could not be fetched
+    try:
+        return olx_cache.cached_description(href, parse_description)
+    except requests.exceptions.RequestException as e:
+        print(f"Error accessing ad URL {href}: {e}")
+        return None
+
+def make_filters(min_price='', max_price='', location=''):
+    # These rules only need the card, so they run before the ad page is requested
+    card_rules = []
+    if min_price or max_price:
+        card_rules.append(price_between(min_price, max_price))
+    if location:
+        card_rules.append(location_contains(location))
+    return FilterPipeline(card_rules)
+
+def scrape_page(url, ad_base_url, max_workers=detail_workers, fetch=None, incremental=None, topk=None, filters=None, seen_urls=None):
     all_valid_listings = []
-    response = requests.get(url)
+    try:
+        response = fetch() if fetch else fetch_result_page(url)
+    except requests.exceptions.RequestException as e:
+        print(f"Error accessing {url}: {e}")
+        return all_valid_listings
     if response.status_code == 200:
-        soup = BeautifulSoup(response.text, 'html.parser')
-        ad_containers = soup.find_all('div', {'data-cy': 'l-card'})
+        ad_containers = olx_pipeline.parse_cards(response)
+        cards = []
         for ad in ad_containers:
-            link_tag = ad.find('a', class_='css-z3gu2d', href=True)
-            if link_tag:
-                relative_href = link_tag['href']
-                href = urljoin(ad_base_url, relative_href)
-                price_tag = ad.find('p', {'data-testid': 'ad-price'})
-                price = price_tag.get_text(strip=True) if price_tag else 'Price not found'
+            if ad.href:
+                href = urljoin(ad_base_url, ad.href)
+                # Price ranges of a split search can overlap at their boundary
+                if seen_urls is not None and not seen_urls.claim(href):
+                    olx_metrics.count('listings_dropped', rule='duplicate')
+                    continue
+                price = ad.price if ad.price is not None else 'Price not found'
                 price_number = price_to_number(price)
-                location_tag = ad.find('p', {'data-testid': 'location-date'})
-                location = format_location(location_tag.get_text(strip=True)) if location_tag else 'Location not found'
-                ad_response = requests.get(href)
-                description = extract_description(BeautifulSoup(ad_response.text, 'html.parser')) if ad_response.status_code == 200 else 'No description available'
-                all_valid_listings.append((price_number, price, href, location, description))
+                location = format_location(ad.location) if ad.location is not None else 'Location not found'
+                # In incremental mode, unchanged listings from earlier runs are skipped. This comes
+                # before the filters so that every listing on the page counts as seen
+                if incremental and not incremental.classify(href, price):
+                    olx_metrics.count('listings_dropped', rule='unchanged')
+                    continue
+                if filters and not filters.accept_card(price, location, ad.title):
+                    continue
+                # In top-K mode, ads too expensive to make the cut are not fetched
+                if topk and not topk.can_enter(price_number):
+                    olx_metrics.count('listings_dropped', rule='top_k')
+                    continue
+                cards.append((price_number, price, href, location))
+        # Fetch the ad pages of this result page concurrently
+        descriptions = map_in_order(fetch_description, [card[2] for card in cards], max_workers)
+        for (price_number, price, href, location), description in zip(cards, descriptions):
+            if description is None:
+                description = 'No description available'
+                if incremental:
+                    incremental.fetch_failed(href)
+            if filters and not filters.accept_description(description):
+                continue
+            all_valid_listings.append((price_number, price, href, location, description))
     else:
         print(f"Failed to retrieve page. Status code: {response.status_code}")
     return all_valid_listings
 
-def write_to_csv(listings):
-    csv_file = 'car_listings.csv'
-    try:
-        with open(csv_file, mode='w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(['Index', 'Link', 'Price', 'Location', 'Description'])
-            for index, price, link, location, description in listings:
-                writer.writerow([index, link, price, location, description])
-        print(f"\nResults have been written to {csv_file}")
-    except IOError as e:
-        print(f"Failed to write CSV file. Error: {e}")
-
-def write_to_json(listings):
-    json_file = 'car_listings.json'
-    try:
-        with open(json_file, mode='w', encoding='utf-8') as file:
-            listings_dict = [{'Index': index, 'Link': link, 'Price': price, 'Location': location, 'Description': description} for index, price, link, location, description in listings]
-            json.dump(listings_dict, file, ensure_ascii=False, indent=4)
-        print(f"Results have also been written to {json_file}")
-    except IOError as e:
-        print(f"Failed to write JSON file. Error: {e}")
+def build_url(car_brand, page, car_model='', year_from='', year_to='', price_from=None, price_to=None):
+    params = {
+        'page': page,
+        'search[order]': 'filter_float_price:asc'
+    }
+    if car_model:
+        params['search[filter_enum_modelo][0]'] = car_model
+    if year_from:
+        params['search[filter_float_year:from]'] = year_from
+    if year_to:
+        params['search[filter_float_year:to]'] = year_to
+    if price_from is not None:
+        params['search[filter_float_price:from]'] = price_from
+    if price_to is not None:
+        params['search[filter_float_price:to]'] = price_to
+    return f"{base_url}{car_brand}/?" + urlencode(params)
 
-def main():
-    car_brand, car_model, year_from, year_to, requested_pages, output_formats = get_user_inputs()
+def crawl_pages(page_urls, first_response, spool, label='', incremental=None, topk=None, filters=None, seen_urls=None):
+    # Returns False if the crawl stopped before the last page
+
+    # Page 1 is the response we already have; the following pages are fetched ahead
+    def fetch_page(url):
+        return first_response if url == page_urls[0] else fetch_result_page(url)
+
+    with closing(prefetch_pages(page_urls, fetch_page)) as pages:
+        for page, (url, future) in enumerate(pages, start=1):
+            print(f"Scraping {label}page {page}: {url}")
+            listings = scrape_page(url, ad_base_url, fetch=future.result, incremental=incremental, topk=topk, filters=filters, seen_urls=seen_urls)
+            with olx_metrics.span('spool_write'):
+                for listing in listings:
+                    spool.write(listing)
+                    if topk:
+                        topk.add(listing)
+                spool.flush()
+            if topk and topk.end_page():
+                print(f"No listing on page {page} is among the {topk.k} cheapest. Ending scraping.")
+                return False
+    return True
+
+def crawl_price_ranges(car_brand, car_model, year_from, year_to, requested_pages, spool, filters):
+    # Each price range is its own search with its own page limit. Returns the
+    # number of pages crawled, or None without crawling anything if a price range
+    # could not be probed
+    def probe(price_from, price_to):
+        url = build_url(car_brand, 1, car_model, year_from, year_to, price_from, price_to)
+        try:
+            response = fetch_result_page(url)
+        except requests.exceptions.RequestException as e:
+            print(f"Error accessing {url}: {e}")
+            return None
+        if response.status_code != 200:
+            print(f"Failed to retrieve {url}. Status code: {response.status_code}")
+            return None
+        return get_total_pages(make_soup(response.text)), response
+
+    shards = olx_shards.plan_shards(probe)
+    if shards is None:
+        return None
+    print(f"Split the search into {len(shards)} price ranges: {', '.join(olx_shards.describe(shard) for shard in shards)}")
+    seen_urls = SeenSet()
+
+    def crawl_shard(shard):
+        page_urls = [build_url(car_brand, page, car_model, year_from, year_to, shard.price_from, shard.price_to)
+                     for page in range(1, min(requested_pages, shard.total_pages) + 1)]
+        crawl_pages(page_urls, shard.response, spool, label=f"{olx_shards.describe(shard)} ", filters=filters, seen_urls=seen_urls)
+        return len(page_urls)
+
+    return sum(map_in_order(crawl_shard, shards, parallel_searches))
+
+@olx_metrics.timed('search')
+def run_search(car_brand, car_model='', year_from='', year_to='', requested_pages=25, output_formats='csv', incremental_mode=False,
+               min_price='', max_price='', location_filter='', top_k=None, split_by_price=False, output_prefix='car_listings', delta_file=None):
+    # Runs one search without asking anything; returns the number of listings written
+    total_listings = 0
     initial_url = f"{base_url}{car_brand}/?" + urlencode({
         'search[order]': 'filter_float_price:asc',
         'search[filter_enum_modelo][0]': car_model if car_model else '',
@@ -117,51 +237,88 @@ def main():
         'search[filter_float_year:to]': year_to if year_to else ''
     })
     
-    response = requests.get(initial_url)
+    response = fetch_result_page(initial_url)
     if response.status_code == 200:
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = make_soup(response.text)
         total_pages = get_total_pages(soup)
+        complete = total_pages <= requested_pages
         total_pages = min(requested_pages, total_pages)
+        incremental = olx_seen.IncrementalRun(olx_seen.search_key('car', initial_url)) if incremental_mode else None
+        topk = TopK(top_k) if top_k else None
+        filters = make_filters(min_price, max_price, location_filter)
+        if split_by_price and (incremental or topk):
+            print("Price ranges are not used together with incremental or top-K mode.")
+            split_by_price = False
         
-        all_valid_listings = []
-        for page in range(1, total_pages + 1):
-            params = {
-                'page': page,
-                'search[order]': 'filter_float_price:asc'
-            }
-            if car_model:
-                params['search[filter_enum_modelo][0]'] = car_model
-            if year_from:
-                params['search[filter_float_year:from]'] = year_from
-            if year_to:
-                params['search[filter_float_year:to]'] = year_to
-            url = f"{base_url}{car_brand}/?" + urlencode(params)
-            print(f"Scraping page {page}: {url}")
-            all_valid_listings.extend(scrape_page(url, ad_base_url))
-        
-        all_valid_listings.sort()
-        index_listings = [(index + 1, price, link, location, description) for index, (_, price, link, location, description) in enumerate(all_valid_listings)]
+        formats = parse_formats(output_formats)
+        # The listings of the run are collected in the listing store, or in a spool file without it
+        store = olx_store.ListingStore('car', olx_seen.search_key('car', initial_url)) if olx_store.enabled else None
+        spool_file = f"{output_prefix}.partial.ndjson"
+        spool = olx_pipeline.writer(store or open_spool(spool_file))
+        if split_by_price:
+            split_pages = crawl_price_ranges(car_brand, car_model, year_from, year_to, requested_pages, spool, filters)
+            if split_pages is None:
+                print("Could not probe every price range. Crawling the search without splitting it instead.")
+                split_by_price = False
+            else:
+                total_pages = split_pages
+        if not split_by_price:
+            page_urls = [build_url(car_brand, page, car_model, year_from, year_to) for page in range(1, total_pages + 1)]
+            complete = crawl_pages(page_urls, response, spool, incremental=incremental, topk=topk, filters=filters) and complete
+        spool.close()
         
-        if 'csv' in output_formats:
-            write_to_csv(index_listings)
+        # Sort by price on disk and number the listings in that order
+        with olx_metrics.span('write_outputs'):
+            sinks = open_sinks(output_prefix, formats)
+            if topk:
+                listings = topk.results()
+            else:
+                listings = store.results() if store else external_sort(spool_file)
+            for index, (_, price, link, location, description) in enumerate(listings, start=1):
+                record = {'Index': index, 'Link': link, 'Price': price, 'Location': location, 'Description': description}
+                write_record(sinks, record)
+                if incremental:
+                    incremental.collect(record)
+                total_listings = index
+            close_sinks(sinks)
+            remove_spool(spool_file)
+        if topk:
+            print(f"Skipped {topk.skipped} ad pages that could not be among the {top_k} cheapest.")
         
-        if 'json' in output_formats:
-            write_to_json(index_listings)
-
-        if 'both' in output_formats:
-            write_to_json(index_listings)
-            write_to_csv(index_listings)
+        filters.print_stats()
+        if not formats:
+            print("Invalid format selected. Please choose 'csv', 'json', 'ndjson', or 'both'.")
         
-        if output_formats not in ['csv', 'json', 'both']:
-            print("Invalid format selected. Please choose 'csv', 'json', or 'both'.")
+        if incremental:
+            delta = incremental.finish(complete)
+            olx_seen.print_delta(delta)
+            olx_seen.write_delta(delta, delta_file or f"{output_prefix}_delta.json")
         
-        if index_listings:
+        if total_listings:
             print(f"\nValid listings found across {total_pages} pages for {car_brand} listings:\n")
-            print(f"\nTotal number of valid listings found across {total_pages} pages: {len(index_listings)}")
+            print(f"\nTotal number of valid listings found across {total_pages} pages: {total_listings}")
         else:
             print(f"\nNo valid listings found for {car_brand} across {total_pages} pages.")
     else:
         print(f"Failed to retrieve the initial page. Status code: {response.status_code}")
+    return total_listings
+
+def main():
+    car_brand, car_model, year_from, year_to, requested_pages, output_formats, incremental_mode, min_price, max_price, location_filter, top_k, split_by_price, parse_processes = get_user_inputs()
+    olx_throttle.configure_logging()
+    olx_pipeline.start(parse_processes)
+    run_search(car_brand, car_model, year_from, year_to, requested_pages, output_formats, incremental_mode,
+               min_price, max_price, location_filter, top_k, split_by_price)
+    olx_http.print_stats()
+    olx_throttle.print_stats()
+    olx_cache.print_stats()
+    olx_parse.print_stats()
+    olx_metrics.print_stats()
+    olx_metrics.export()
+    olx_cache.close()
+    olx_store.close()
+    olx_pipeline.stop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with olx_metrics.profile():
+        main()
\ No newline at end of file
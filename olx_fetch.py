@@ -0,0 +1,59 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import olx_throttle
+
+# Threads fetching the ad detail pages of one result page. There are as many as
+# the per host throttle can ever allow; its current limit decides how many of
+# them are requesting at a time
+detail_workers = olx_throttle.max_concurrency
+# Number of searches (or price ranges of one search) crawled at the same time
+parallel_searches = 4
+
+def map_in_order(func, items, max_workers=None):
+    items = list(items)
+    if max_workers is None:
+        max_workers = detail_workers
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    # Results come back in submission order, so the listing order is kept
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
+
+# Number of result pages downloaded ahead of the one being scraped
+prefetch_depth = 2
+
+def prefetch_pages(urls, fetch, depth=None):
+    # Yields (url, future) in order, keeping the next `depth` pages in flight.
+    # Closing the generator (e.g. breaking out of the loop) cancels the rest.
+    if depth is None:
+        depth = prefetch_depth
+    urls = iter(urls)
+    executor = ThreadPoolExecutor(max_workers=depth + 1)
+    pending = deque()
+    try:
+        for url in islice(urls, depth + 1):
+            pending.append((url, executor.submit(fetch, url)))
+        while pending:
+            url, future = pending.popleft()
+            for next_url in islice(urls, 1):
+                pending.append((next_url, executor.submit(fetch, next_url)))
+            yield url, future
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+class SeenSet:
+    # Listing URLs shared by crawls running in several threads
+    def __init__(self):
+        self.urls = set()
+        self.lock = threading.Lock()
+
+    def claim(self, url):
+        # True for the first caller with this URL, False for every later one
+        with self.lock:
+            if url in self.urls:
+                return False
+            self.urls.add(url)
+            return True
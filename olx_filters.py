@@ -0,0 +1,71 @@
+import re
+import threading
+from collections import Counter
+
+import olx_metrics
+
+# A rule is a (name, predicate) pair. Card rules get (price, location, title)
+# as parsed from the l-card and run before the ad page is requested;
+# description rules get the extracted description and run after it.
+
+def price_value(price_str):
+    price_str = re.sub(r'[^\d,]', '', price_str or '').replace(',', '.')
+    try:
+        return float(price_str)
+    except ValueError:
+        return None
+
+def price_between(min_price=None, max_price=None):
+    low = float(min_price) if min_price not in (None, '') else None
+    high = float(max_price) if max_price not in (None, '') else None
+
+    def predicate(price, location, title):
+        value = price_value(price)
+        if value is None:
+            return True  # Keep ads without a readable price, like the search does
+        return (low is None or value >= low) and (high is None or value <= high)
+    return ('price', predicate)
+
+def location_contains(text):
+    text = text.lower()
+    return ('location', lambda price, location, title: text in (location or '').lower())
+
+def title_excludes(text):
+    text = text.lower()
+    return (f'title contains "{text}"', lambda price, location, title: text not in (title or '').lower())
+
+def description_excludes(text):
+    return (f'description contains "{text}"', lambda description: text not in description)
+
+class FilterPipeline:
+    def __init__(self, card_rules=(), description_rules=()):
+        self.card_rules = list(card_rules)
+        self.description_rules = list(description_rules)
+        self.dropped = Counter()
+        self.avoided_requests = 0
+        self.lock = threading.Lock()
+
+    def accept_card(self, price, location, title):
+        for name, predicate in self.card_rules:
+            if not predicate(price, location, title):
+                with self.lock:
+                    self.dropped[name] += 1
+                    self.avoided_requests += 1
+                olx_metrics.count('listings_dropped', rule=name)
+                return False
+        return True
+
+    def accept_description(self, description):
+        for name, predicate in self.description_rules:
+            if not predicate(description):
+                with self.lock:
+                    self.dropped[name] += 1
+                olx_metrics.count('listings_dropped', rule=name)
+                return False
+        return True
+
+    def print_stats(self):
+        if not self.card_rules and not self.description_rules:
+            return
+        dropped = ', '.join(f"{name}: {count}" for name, count in self.dropped.most_common()) or 'none'
+        print(f"Filters: {self.avoided_requests} ad page requests avoided; dropped listings by rule: {dropped}")
@@ -0,0 +1,119 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import olx_fetch
+import olx_throttle
+import olx_metrics
+
+# Seconds to wait for the TCP/TLS connection and for the response body
+connect_timeout = 5
+read_timeout = 20
+# Retries for connection errors and the statuses below, with exponential backoff
+max_retries = 4
+backoff_base = 0.5
+backoff_max = 30
+retry_statuses = {429, 500, 502, 503, 504}
+
+_session = None
+_lock = threading.Lock()
+counters = {'requests': 0, 'retries': 0, 'failures': 0}
+
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            # One keep-alive pool per host, big enough for all concurrent fetches
+            per_crawl = olx_fetch.detail_workers + olx_fetch.prefetch_depth + 1
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=per_crawl * olx_fetch.parallel_searches)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+    return _session
+
+def count(name, amount=1):
+    with _lock:
+        counters[name] = counters.get(name, 0) + amount
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(attempt, response=None):
+    if response is not None:
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None:
+            return min(retry_after, backoff_max)
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+def get(url, **kwargs):
+    kwargs.setdefault('timeout', (connect_timeout, read_timeout))
+    session = get_session()
+    throttle = olx_throttle.for_url(url)
+    for attempt in range(max_retries + 1):
+        count('requests')
+        # Every attempt holds a slot of the host's throttle until its response is in
+        throttle.acquire()
+        started = time.monotonic()
+        try:
+            response = session.get(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            throttle.release(time.monotonic() - started)
+            olx_metrics.count('http_errors', error=type(e).__name__)
+            if attempt == max_retries:
+                count('failures')
+                raise
+            delay = retry_delay(attempt)
+        except BaseException:
+            throttle.cancel()
+            raise
+        else:
+            throttle.release(time.monotonic() - started, response.status_code)
+            olx_metrics.count('http_responses', status=response.status_code)
+            olx_metrics.count('http_bytes', len(response.content))
+            if response.status_code not in retry_statuses:
+                return response
+            if attempt == max_retries:
+                count('failures')
+                return response
+            delay = retry_delay(attempt, response)
+            response.close()
+        count('retries')
+        time.sleep(delay)
+
+def connection_stats():
+    opened = served = 0
+    if _session is not None:
+        for adapter in set(_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+                    served += pool.num_requests
+    return {'connections_opened': opened, 'connections_reused': max(0, served - opened)}
+
+def stats():
+    with _lock:
+        result = dict(counters)
+    result.update(connection_stats())
+    return result
+
+def print_stats():
+    result = stats()
+    print(f"HTTP: {result['requests']} requests, {result['connections_opened']} connections opened, "
+          f"{result['connections_reused']} reused, {result['retries']} retries, {result['failures']} failures")
@@ -0,0 +1,161 @@
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Timing spans and counters for one run. Span times are summed over all the
+# threads that ran the phase, so with concurrent fetches a phase can add up to
+# more than the wall clock time of the run.
+
+enabled = True
+# Written by export(); set to None to skip a file
+report_path = os.environ.get('OLX_RUN_REPORT', 'olx_run_report.json')
+textfile_path = os.environ.get('OLX_METRICS_TEXTFILE', 'olx_metrics.prom')
+# cProfile output of the whole run, e.g. OLX_PROFILE=run.prof; view it with
+# python -m pstats run.prof or snakeviz. cProfile only sees the main thread, so
+# for the fetch threads sample the process instead: py-spy record -o run.svg -- python ...
+profile_path = os.environ.get('OLX_PROFILE')
+
+_lock = threading.Lock()
+_started = time.time()
+# phase -> [calls, seconds, slowest call]
+_spans = {}
+# (name, sorted label pairs) -> value
+_counters = Counter()
+
+def record(phase, seconds):
+    with _lock:
+        entry = _spans.get(phase)
+        if entry is None:
+            _spans[phase] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+
+@contextmanager
+def span(phase):
+    if not enabled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+def timed(phase, func=None):
+    # Decorator, or timed(phase, func) to wrap an existing function
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(phase, time.perf_counter() - started)
+        return wrapper
+    return decorate(func) if func is not None else decorate
+
+def count(name, amount=1, **labels):
+    if enabled:
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with _lock:
+            _counters[key] += amount
+
+def report():
+    with _lock:
+        spans = {phase: list(entry) for phase, entry in _spans.items()}
+        counters = dict(_counters)
+    result = {
+        'started': _started,
+        'seconds': time.time() - _started,
+        'phases': {phase: {'calls': calls, 'seconds': seconds, 'mean_ms': 1000 * seconds / calls, 'max_ms': 1000 * slowest}
+                   for phase, (calls, seconds, slowest) in sorted(spans.items(), key=lambda item: -item[1][1])},
+        'counters': {},
+    }
+    for (name, labels), value in sorted(counters.items()):
+        result['counters'].setdefault(name, {})[','.join(f"{label}={value}" for label, value in labels) or 'total'] = value
+    return result
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + '}'
+
+def prometheus_text():
+    with _lock:
+        spans = {phase: list(entry) for phase, entry in _spans.items()}
+        counters = dict(_counters)
+    lines = [
+        '# HELP olx_run_start_time_seconds Start of the run as a Unix timestamp.',
+        '# TYPE olx_run_start_time_seconds gauge',
+        f"olx_run_start_time_seconds {_started:.3f}",
+        '# HELP olx_run_duration_seconds Wall clock time of the run.',
+        '# TYPE olx_run_duration_seconds gauge',
+        f"olx_run_duration_seconds {time.time() - _started:.3f}",
+    ]
+    if spans:
+        lines += ['# HELP olx_phase_seconds_total Time spent in each phase, summed over threads.',
+                  '# TYPE olx_phase_seconds_total counter']
+        lines += [f"olx_phase_seconds_total{_label_text([('phase', phase)])} {entry[1]:.6f}" for phase, entry in sorted(spans.items())]
+        lines += ['# HELP olx_phase_calls_total Number of times each phase ran.',
+                  '# TYPE olx_phase_calls_total counter']
+        lines += [f"olx_phase_calls_total{_label_text([('phase', phase)])} {entry[0]}" for phase, entry in sorted(spans.items())]
+        lines += ['# HELP olx_phase_max_seconds Slowest single run of each phase.',
+                  '# TYPE olx_phase_max_seconds gauge']
+        lines += [f"olx_phase_max_seconds{_label_text([('phase', phase)])} {entry[2]:.6f}" for phase, entry in sorted(spans.items())]
+    for name in sorted({name for name, _ in counters}):
+        lines += [f"# TYPE olx_{name}_total counter"]
+        lines += [f"olx_{name}_total{_label_text(labels)} {value}"
+                  for (counter, labels), value in sorted(counters.items()) if counter == name]
+    return '\n'.join(lines) + '\n'
+
+def _write_atomically(path, text):
+    # The node_exporter textfile collector must never see a half written file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, mode='w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(temporary, path)
+
+def export(report_file=None, textfile=None, announce=True):
+    report_file = report_file or report_path
+    textfile = textfile or textfile_path
+    try:
+        if report_file:
+            _write_atomically(report_file, json.dumps(report(), indent=4))
+            if announce:
+                print(f"Run report has been written to {report_file}")
+        if textfile:
+            _write_atomically(textfile, prometheus_text())
+    except IOError as e:
+        print(f"Failed to write the run metrics. Error: {e}")
+
+def print_stats(limit=6):
+    phases = report()['phases']
+    if phases:
+        print("Time by phase: " + ', '.join(f"{phase} {entry['seconds']:.2f}s ({entry['calls']} calls)"
+                                            for phase, entry in list(phases.items())[:limit]))
+
+@contextmanager
+def profile():
+    # Profiles everything in the block when OLX_PROFILE names an output file
+    if not profile_path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+        print(f"Profile has been written to {profile_path}")
@@ -1,9 +1,19 @@
 import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urlencode, urljoin
 import re
-import csv
-import json
+from contextlib import closing
+from olx_fetch import map_in_order, prefetch_pages, detail_workers
+import olx_http
+import olx_throttle
+import olx_metrics
+import olx_cache
+import olx_seen
+import olx_store
+from olx_topk import TopK
+from olx_filters import FilterPipeline, price_between, location_contains
+import olx_parse
+import olx_pipeline
+from olx_output import parse_formats, open_sinks, open_spool, write_record, close_sinks, external_sort, remove_spool
 
 # Base URL for the bike listings
 base_url = 'https://www.olx.pt/carros-motos-e-barcos/motociclos-scooters/'
@@ -16,9 +26,18 @@ def get_user_inputs():
     year_from = input("Enter the starting year (or press Enter to skip): ").strip()
     year_to = input("Enter the ending year (or press Enter to skip): ").strip()
     requested_pages = int(input("Enter the number of pages to scrape: ").strip())
-    output_formats = input("Enter the desired output formats (csv, json, or both): ").strip().lower()
-    return bike_brand, bike_model, year_from, year_to, requested_pages, output_formats
+    output_formats = input("Enter the desired output formats (csv, json, ndjson, or both): ").strip().lower()
+    incremental = input("Only fetch new or changed listings since the last run? (y/N): ").strip().lower() == 'y'
+    min_price = input("Enter the minimum price (or press Enter to skip): ").strip()
+    max_price = input("Enter the maximum price (or press Enter to skip): ").strip()
+    location = input("Only keep listings whose location contains (or press Enter to skip): ").strip()
+    top_k = input("Only keep the N cheapest listings (or press Enter to keep all): ").strip()
+    top_k = int(top_k) if top_k else None
+    parse_processes = input("Number of parser processes (or press Enter to parse in the fetch threads): ").strip()
+    parse_processes = int(parse_processes) if parse_processes else 0
+    return bike_brand, bike_model, year_from, year_to, requested_pages, output_formats, incremental, min_price, max_price, location, top_k, parse_processes
 
+@olx_metrics.timed('price_to_number')
 def price_to_number(price_str):
     price_str = re.sub(r'[^\d,]', '', price_str)
     price_str = price_str.replace(',', '.')
@@ -27,6 +46,7 @@ def price_to_number(price_str):
     except ValueError:
         return float('inf')
 
+@olx_metrics.timed('format_location')
 def format_location(location_str):
     location_str = location_str.strip()
     dash_index = location_str.find('-')
@@ -44,111 +64,198 @@ def extract_description(soup):
         return description
     return 'No description available'
 
-def scrape_page(url, ad_base_url, seen_urls):
+def parse_description(response):
+    return olx_pipeline.parse_description(response, extract_description)
+
+def fetch_description(href):
+    # None if the ad page could not be fetched
+    try:
+        return olx_cache.cached_description(href, parse_description)
+    except requests.exceptions.RequestException as e:
+        print(f"Error accessing ad URL {href}: {e}")
+        return None
+
+def fetch_result_page(url):
+    with olx_metrics.span('result_page_fetch'):
+        return olx_http.get(url)
+
+def make_filters(min_price='', max_price='', location=''):
+    # These rules only need the card, so they run before the ad page is requested
+    card_rules = []
+    if min_price or max_price:
+        card_rules.append(price_between(min_price, max_price))
+    if location:
+        card_rules.append(location_contains(location))
+    return FilterPipeline(card_rules)
+
+def scrape_page(url, ad_base_url, seen_urls, max_workers=detail_workers, fetch=None, incremental=None, topk=None, filters=None):
+    # Returns the listings kept and the number of cards not seen on an earlier
+    # page, or None for that number if the page could not be read
     all_valid_listings = []
-    response = requests.get(url)
+    try:
+        response = fetch() if fetch else fetch_result_page(url)
+    except requests.exceptions.RequestException as e:
+        print(f"Error accessing {url}: {e}")
+        return [], None
     if response.status_code == 200:
-        soup = BeautifulSoup(response.text, 'html.parser')
-        ad_containers = soup.find_all('div', {'data-cy': 'l-card'})
+        ad_containers = olx_pipeline.parse_cards(response)
         if not ad_containers:
-            return []
+            return [], 0
         
+        new_cards = 0
+        cards = []
         for ad in ad_containers:
-            link_tag = ad.find('a', class_='css-z3gu2d', href=True)
-            if link_tag:
-                relative_href = link_tag['href']
-                href = urljoin(ad_base_url, relative_href)
+            if ad.href:
+                href = urljoin(ad_base_url, ad.href)
                 
                 # Skip duplicates by checking if the link has been seen before
                 if href in seen_urls:
+                    olx_metrics.count('listings_dropped', rule='duplicate')
                     continue
                 seen_urls.add(href)
+                new_cards += 1
 
-                price_tag = ad.find('p', {'data-testid': 'ad-price'})
-                price = price_tag.get_text(strip=True) if price_tag else 'Price not found'
+                price = ad.price if ad.price is not None else 'Price not found'
                 price_number = price_to_number(price)
-                location_tag = ad.find('p', {'data-testid': 'location-date'})
-                location = format_location(location_tag.get_text(strip=True)) if location_tag else 'Location not found'
-                
-                ad_response = requests.get(href)
-                description = extract_description(BeautifulSoup(ad_response.text, 'html.parser')) if ad_response.status_code == 200 else 'No description available'
-                all_valid_listings.append((price_number, price, href, location, description))
+                location = format_location(ad.location) if ad.location is not None else 'Location not found'
+                # In incremental mode, unchanged listings from earlier runs are skipped. This comes
+                # before the filters so that every listing on the page counts as seen
+                if incremental and not incremental.classify(href, price):
+                    olx_metrics.count('listings_dropped', rule='unchanged')
+                    continue
+                if filters and not filters.accept_card(price, location, ad.title):
+                    continue
+                # In top-K mode, ads too expensive to make the cut are not fetched
+                if topk and not topk.can_enter(price_number):
+                    olx_metrics.count('listings_dropped', rule='top_k')
+                    continue
+                cards.append((price_number, price, href, location))
+
+        # Fetch the ad pages of this result page concurrently
+        descriptions = map_in_order(fetch_description, [card[2] for card in cards], max_workers)
+        for (price_number, price, href, location), description in zip(cards, descriptions):
+            if description is None:
+                description = 'No description available'
+                if incremental:
+                    incremental.fetch_failed(href)
+            if filters and not filters.accept_description(description):
+                continue
+            all_valid_listings.append((price_number, price, href, location, description))
     else:
         print(f"Failed to retrieve page {url}. Status code: {response.status_code}")
-        return []  # Stop on error pages
-    return all_valid_listings
-
-def write_to_csv(listings):
-    csv_file = 'bike_listings.csv'
-    try:
-        with open(csv_file, mode='w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(['Index', 'Link', 'Price', 'Location', 'Description'])
-            for index, price, link, location, description in listings:
-                writer.writerow([index, link, price, location, description])
-        print(f"\nResults have been written to {csv_file}")
-    except IOError as e:
-        print(f"Failed to write CSV file. Error: {e}")
-
-def write_to_json(listings):
-    json_file = 'bike_listings.json'
-    try:
-        with open(json_file, mode='w', encoding='utf-8') as file:
-            listings_dict = [{'Index': index, 'Link': link, 'Price': price, 'Location': location, 'Description': description} for index, price, link, location, description in listings]
-            json.dump(listings_dict, file, ensure_ascii=False, indent=4)
-        print(f"Results have also been written to {json_file}")
-    except IOError as e:
-        print(f"Failed to write JSON file. Error: {e}")
+        return [], None  # Stop on error pages
+    return all_valid_listings, new_cards
 
-def main():
-    bike_brand, bike_model, year_from, year_to, requested_pages, output_formats = get_user_inputs()
-    
-    # Initial URL setup
-    base_params = {
+def build_url(bike_brand, page, bike_model='', year_from='', year_to=''):
+    params = {
         'search[order]': 'filter_float_price:asc',
         'search[filter_enum_modelo][0]': bike_model if bike_model else '',
         'search[filter_float_year:from]': year_from if year_from else '',
-        'search[filter_float_year:to]': year_to if year_to else ''
+        'search[filter_float_year:to]': year_to if year_to else '',
+        'page': page
     }
+    return f"{base_url}{bike_brand}/?" + urlencode(params)
+
+@olx_metrics.timed('search')
+def run_search(bike_brand, bike_model='', year_from='', year_to='', requested_pages=25, output_formats='csv', incremental_mode=False,
+               min_price='', max_price='', location_filter='', top_k=None, output_prefix='bike_listings', delta_file='motorcycle_listings_delta.json'):
+    # Runs one search without asking anything; returns the number of listings written
     
-    all_valid_listings = []
+    formats = parse_formats(output_formats)
     seen_urls = set()  # To track URLs we've already seen
     
-    for page in range(1, requested_pages + 1):
-        params = base_params.copy()
-        params['page'] = page
-        page_url = f"{base_url}{bike_brand}/?" + urlencode(params)
-        print(f"Scraping page {page}: {page_url}")
-        
-        listings_on_page = scrape_page(page_url, ad_base_url, seen_urls)
-        
-        if not listings_on_page:
-            print(f"No new listings found on page {page}. Ending scraping.")
-            break  # If no new listings are found, stop scraping
-        
-        all_valid_listings.extend(listings_on_page)
+    page_urls = [build_url(bike_brand, page, bike_model, year_from, year_to) for page in range(1, requested_pages + 1)]
+    # Built from page 1 even when no page is requested
+    key = olx_seen.search_key('motorcycle', build_url(bike_brand, 1, bike_model, year_from, year_to))
+    # The listings of the run are collected in the listing store, or in a spool file without it
+    store = olx_store.ListingStore('motorcycle', key) if olx_store.enabled else None
+    spool_file = f"{output_prefix}.partial.ndjson"
+    spool = olx_pipeline.writer(store or open_spool(spool_file))
+    incremental = olx_seen.IncrementalRun(key) if incremental_mode else None
+    topk = TopK(top_k) if top_k else None
+    filters = make_filters(min_price, max_price, location_filter)
+    complete = False
     
-    # Sort listings and write to CSV/JSON
-    all_valid_listings.sort()
-    index_listings = [(index + 1, price, link, location, description) for index, (_, price, link, location, description) in enumerate(all_valid_listings)]
+    # The next result pages download while the current page's ads are fetched
+    with closing(prefetch_pages(page_urls, fetch_result_page)) as pages:
+        for page, (page_url, future) in enumerate(pages, start=1):
+            print(f"Scraping page {page}: {page_url}")
+            
+            listings_on_page, new_cards = scrape_page(page_url, ad_base_url, seen_urls, fetch=future.result, incremental=incremental, topk=topk, filters=filters)
+            
+            with olx_metrics.span('spool_write'):
+                for listing in listings_on_page:
+                    spool.write(listing)
+                    if topk:
+                        topk.add(listing)
+                spool.flush()
+            
+            if topk and topk.end_page():
+                print(f"No listing on page {page} is among the {top_k} cheapest. Ending scraping.")
+                break
+            
+            if new_cards is None:
+                print(f"Could not read page {page}. Ending scraping.")
+                break
+            
+            # Past the last page the site repeats it, so a page without new cards is the end,
+            # however many of its cards the filters dropped
+            if not new_cards:
+                print(f"No new listings found on page {page}. Ending scraping.")
+                complete = True
+                break
+    spool.close()
     
-    if 'csv' in output_formats:
-        write_to_csv(index_listings)
+    # Sort by price on disk and number the listings in that order
+    total_listings = 0
+    with olx_metrics.span('write_outputs'):
+        sinks = open_sinks(output_prefix, formats)
+        if topk:
+            listings = topk.results()
+        else:
+            listings = store.results() if store else external_sort(spool_file)
+        for index, (_, price, link, location, description) in enumerate(listings, start=1):
+            record = {'Index': index, 'Link': link, 'Price': price, 'Location': location, 'Description': description}
+            write_record(sinks, record)
+            if incremental:
+                incremental.collect(record)
+            total_listings = index
+        close_sinks(sinks)
+        remove_spool(spool_file)
+    if topk:
+        print(f"Skipped {topk.skipped} ad pages that could not be among the {top_k} cheapest.")
     
-    if 'json' in output_formats:
-        write_to_json(index_listings)
-
-    if 'both' in output_formats:
-        write_to_json(index_listings)
-        write_to_csv(index_listings)
+    filters.print_stats()
+    if not formats:
+        print("Invalid format selected. Please choose 'csv', 'json', 'ndjson', or 'both'.")
     
-    if output_formats not in ['csv', 'json', 'both']:
-        print("Invalid format selected. Please choose 'csv', 'json', or 'both'.")
+    if incremental:
+        delta = incremental.finish(complete)
+        olx_seen.print_delta(delta)
+        olx_seen.write_delta(delta, delta_file or f"{output_prefix}_delta.json")
     
-    if index_listings:
-        print(f"\nTotal number of valid listings found: {len(index_listings)}")
+    if total_listings:
+        print(f"\nTotal number of valid listings found: {total_listings}")
     else:
         print(f"\nNo valid listings found for {bike_brand}.")
+    return total_listings
+
+def main():
+    bike_brand, bike_model, year_from, year_to, requested_pages, output_formats, incremental_mode, min_price, max_price, location_filter, top_k, parse_processes = get_user_inputs()
+    olx_throttle.configure_logging()
+    olx_pipeline.start(parse_processes)
+    run_search(bike_brand, bike_model, year_from, year_to, requested_pages, output_formats, incremental_mode,
+               min_price, max_price, location_filter, top_k)
+    olx_http.print_stats()
+    olx_throttle.print_stats()
+    olx_cache.print_stats()
+    olx_parse.print_stats()
+    olx_metrics.print_stats()
+    olx_metrics.export()
+    olx_cache.close()
+    olx_store.close()
+    olx_pipeline.stop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with olx_metrics.profile():
+        main()
\ No newline at end of file
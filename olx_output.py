@@ -0,0 +1,142 @@
+import csv
+import heapq
+import json
+import os
+import re
+import tempfile
+import threading
+from itertools import islice
+
+fields = ['Index', 'Link', 'Price', 'Location', 'Description']
+# Records held in memory at once while sorting a spool file by price
+sort_chunk_size = 10000
+
+def parse_formats(output_formats):
+    formats = set()
+    for name in re.split(r'[\s,]+', output_formats.strip().lower()):
+        if name == 'both':
+            formats.update(('csv', 'json'))
+        elif name in ('csv', 'json', 'ndjson'):
+            formats.add(name)
+    return formats
+
+class CsvSink:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, mode='w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(fields)
+
+    def write(self, record):
+        self.writer.writerow([record[field] for field in fields])
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        print(f"Results have been written to {self.path}")
+
+class NdjsonSink:
+    # Safe to share between threads, e.g. as the spool of a sharded crawl
+    def __init__(self, path, announce=True, mode='w'):
+        self.path = path
+        self.announce = announce
+        self.file = open(path, mode=mode, encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.file.write(line)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+        if self.announce:
+            print(f"Results have been written to {self.path}")
+
+class JsonArraySink:
+    # Writes the same document as json.dump(records, indent=4), one element at a time
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, mode='w', encoding='utf-8')
+        self.file.write('[')
+        self.count = 0
+
+    def write(self, record):
+        element = json.dumps(record, ensure_ascii=False, indent=4).replace('\n', '\n    ')
+        self.file.write((',\n    ' if self.count else '\n    ') + element)
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.write('\n]' if self.count else ']')
+        self.file.close()
+        print(f"Results have been written to {self.path}")
+
+sink_types = {'csv': CsvSink, 'json': JsonArraySink, 'ndjson': NdjsonSink}
+
+def open_sinks(prefix, formats):
+    sinks = []
+    for name in sorted(formats):
+        path = f"{prefix}.{name}"
+        try:
+            sinks.append(sink_types[name](path))
+        except IOError as e:
+            print(f"Failed to write {name.upper()} file. Error: {e}")
+    return sinks
+
+def write_record(sinks, record):
+    for sink in sinks:
+        sink.write(record)
+
+def flush_sinks(sinks):
+    for sink in sinks:
+        sink.flush()
+
+def close_sinks(sinks):
+    for sink in sinks:
+        sink.close()
+
+def open_spool(path):
+    # Unsorted records as they are scraped, so a crash keeps the work done so far
+    return NdjsonSink(path, announce=False)
+
+def read_spool(path):
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            yield tuple(json.loads(line))
+
+def external_sort(path, chunk_size=None):
+    # Sorts the spooled tuples in runs of chunk_size, spills each run to a
+    # temporary file and merges the runs, so memory stays bounded
+    if chunk_size is None:
+        chunk_size = sort_chunk_size
+    runs = []
+    try:
+        records = read_spool(path)
+        while True:
+            chunk = sorted(islice(records, chunk_size))
+            if not chunk:
+                break
+            run = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+            for item in chunk:
+                run.write(json.dumps(item, ensure_ascii=False) + '\n')
+            run.seek(0)
+            runs.append(run)
+        yield from heapq.merge(*[(tuple(json.loads(line)) for line in run) for run in runs])
+    finally:
+        for run in runs:
+            run.close()
+
+def remove_spool(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
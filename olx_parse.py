@@ -0,0 +1,152 @@
+import json
+import re
+import threading
+from collections import namedtuple
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+# lxml is much faster than the pure Python parser, use it when it is installed
+try:
+    import lxml  # noqa: F401
+    parser = 'lxml'
+except ImportError:
+    parser = 'html.parser'
+
+# Only the parts of the pages the scrapers read are turned into a tree
+card_strainer = SoupStrainer('div', attrs={'data-cy': 'l-card'})
+description_strainer = SoupStrainer('div', attrs={'data-cy': 'ad_description'})
+
+# Raw text of one l-card; fields are None when the tag is missing
+Card = namedtuple('Card', ['href', 'price', 'location', 'title'])
+
+# OLX pages embed their data as a JSON encoded string assigned to this variable
+state_marker = 'window.__PRERENDERED_STATE__'
+_state_start = re.compile(r'\s*=\s*')
+_decoder = json.JSONDecoder()
+
+_lock = threading.Lock()
+path_counts = {'listing_json': 0, 'listing_html': 0, 'description_json': 0, 'description_html': 0}
+
+def count(name):
+    with _lock:
+        path_counts[name] += 1
+
+def make_soup(html, parse_only=None):
+    try:
+        return BeautifulSoup(html, parser, parse_only=parse_only)
+    except Exception:
+        if parser == 'html.parser':
+            raise
+        return BeautifulSoup(html, 'html.parser', parse_only=parse_only)
+
+def prerendered_state(html):
+    start = html.find(state_marker)
+    if start == -1:
+        return None
+    match = _state_start.match(html, start + len(state_marker))
+    if not match:
+        return None
+    try:
+        state, _ = _decoder.raw_decode(html, match.end())
+        if isinstance(state, str):
+            state = json.loads(state)
+    except ValueError:
+        return None
+    return state if isinstance(state, dict) else None
+
+def cards_from_state(state):
+    try:
+        ads = state['listing']['listing']['ads']
+        cards = []
+        for ad in ads:
+            location = ad.get('location') or {}
+            place = ', '.join(part for part in (location.get('cityName'), location.get('districtName')) if part)
+            cards.append(Card(ad['url'], (ad.get('price') or {}).get('displayValue'), place or None, ad.get('title')))
+    except (KeyError, TypeError, AttributeError):
+        return None
+    return cards or None
+
+class _TextCollector(HTMLParser):
+    # Same text as get_text(separator='\n', strip=True) on the description
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_data(self, data):
+        data = data.strip()
+        if data:
+            self.parts.append(data)
+
+def html_to_text(fragment):
+    collector = _TextCollector()
+    collector.feed(fragment)
+    collector.close()
+    return '\n'.join(collector.parts)
+
+def description_from_state(state):
+    try:
+        description = state['ad']['ad']['description']
+    except (KeyError, TypeError):
+        return None
+    if not isinstance(description, str):
+        return None
+    return html_to_text(description) or None
+
+def read_cards(html):
+    # Embedded JSON first, the l-card markup if it is missing or unreadable.
+    # Returns the cards and which of the two was used.
+    state = prerendered_state(html)
+    cards = cards_from_state(state) if state else None
+    if cards is not None:
+        return cards, 'listing_json'
+    return parse_card_markup(html), 'listing_html'
+
+def parse_cards(html):
+    cards, path = read_cards(html)
+    count(path)
+    return cards
+
+def read_cards_bytes(content, encoding):
+    # Entry point for parser processes, which get the undecoded page
+    return read_cards(content.decode(encoding or 'utf-8', errors='replace'))
+
+def parse_card_markup(html):
+    cards = []
+    for ad in make_soup(html, card_strainer).find_all('div', {'data-cy': 'l-card'}):
+        link_tag = ad.find('a', class_='css-z3gu2d', href=True)
+        price_tag = ad.find('p', {'data-testid': 'ad-price'})
+        location_tag = ad.find('p', {'data-testid': 'location-date'})
+        title_tag = ad.find(['h4', 'h6'])
+        cards.append(Card(
+            link_tag['href'] if link_tag else None,
+            price_tag.get_text(strip=True) if price_tag else None,
+            location_tag.get_text(strip=True) if location_tag else None,
+            title_tag.get_text(strip=True) if title_tag else None,
+        ))
+    return cards
+
+def description_soup(html):
+    return make_soup(html, description_strainer)
+
+def read_description(html, extract):
+    # extract is the scraper's soup based extract_description, used as fallback
+    state = prerendered_state(html)
+    description = description_from_state(state) if state else None
+    if description is not None:
+        return description, 'description_json'
+    return extract(description_soup(html)), 'description_html'
+
+def parse_description(html, extract):
+    description, path = read_description(html, extract)
+    count(path)
+    return description
+
+def read_description_bytes(content, encoding, extract):
+    return read_description(content.decode(encoding or 'utf-8', errors='replace'), extract)
+
+def print_stats():
+    with _lock:
+        counts = dict(path_counts)
+    print(f"Parsing: {counts['listing_json']} result pages from embedded JSON, {counts['listing_html']} from HTML; "
+          f"{counts['description_json']} ad pages from embedded JSON, {counts['description_html']} from HTML")
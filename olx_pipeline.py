@@ -0,0 +1,99 @@
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import olx_parse
+import olx_metrics
+
+# Optional three stage pipeline: the fetch threads hand raw pages to a pool of
+# parser processes, and a writer thread drains the parsed records to disk.
+# Bounded queues between the stages make a fast stage wait for a slow one.
+
+# Pages handed to the parser processes and not parsed yet
+parse_queue_size = 32
+# Records waiting for the writer thread
+write_queue_size = 256
+
+_pool = None
+_slots = None
+
+def start(processes):
+    global _pool, _slots
+    if processes and _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=processes)
+        _slots = threading.BoundedSemaphore(parse_queue_size)
+        # Start the workers now, before the fetch threads exist
+        _pool.submit(int).result()
+
+def stop():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+def _in_parser(func, *args):
+    # Blocks the calling fetch thread while the parse queue is full
+    with _slots:
+        return _pool.submit(func, *args).result()
+
+@olx_metrics.timed('parse_result_page')
+def parse_cards(response):
+    if _pool is None:
+        return olx_parse.parse_cards(response.text)
+    cards, path = _in_parser(olx_parse.read_cards_bytes, response.content, response.encoding)
+    olx_parse.count(path)
+    return cards
+
+@olx_metrics.timed('parse_ad_page')
+def parse_description(response, extract):
+    # extract has to be a module level function so it can be sent to a process
+    if _pool is None:
+        return olx_parse.parse_description(response.text, extract)
+    description, path = _in_parser(olx_parse.read_description_bytes, response.content, response.encoding, extract)
+    olx_parse.count(path)
+    return description
+
+_FLUSH = object()
+_CLOSE = object()
+
+class BackgroundWriter:
+    # Wraps a sink so writes happen in a separate thread; write() only blocks
+    # when write_queue_size records are already waiting
+    def __init__(self, sink, size=None):
+        self.sink = sink
+        self.queue = queue.Queue(size or write_queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _CLOSE:
+                break
+            if self.error is not None:
+                continue
+            try:
+                if item is _FLUSH:
+                    self.sink.flush()
+                else:
+                    self.sink.write(item)
+            except Exception as e:
+                self.error = e
+
+    def write(self, record):
+        self.queue.put(record)
+
+    def flush(self):
+        self.queue.put(_FLUSH)
+
+    def close(self):
+        self.queue.put(_CLOSE)
+        self.thread.join()
+        self.sink.close()
+        if self.error is not None:
+            raise self.error
+
+def writer(sink):
+    # Runs sink in a writer thread when the parser processes are in use
+    return BackgroundWriter(sink) if _pool is not None else sink
@@ -0,0 +1,139 @@
+import json
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+# Listings seen by earlier runs of each saved search, used by incremental mode
+store_path = 'olx_seen.sqlite3'
+
+_conn = None
+_lock = threading.Lock()
+
+def get_connection():
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(store_path, check_same_thread=False)
+        conn.execute('''CREATE TABLE IF NOT EXISTS seen_listings (
+            search_key TEXT NOT NULL,
+            url TEXT NOT NULL,
+            price TEXT NOT NULL,
+            first_seen REAL NOT NULL,
+            last_seen REAL NOT NULL,
+            PRIMARY KEY (search_key, url))''')
+        # Searches whose current listings olx_watch has recorded, even if there were none
+        conn.execute('''CREATE TABLE IF NOT EXISTS primed_searches (
+            search_key TEXT PRIMARY KEY,
+            primed_at REAL NOT NULL)''')
+        _conn = conn
+    return _conn
+
+def search_key(category, url):
+    # The same search always maps to the same key, whatever page the URL points at
+    parts = urlsplit(url)
+    params = sorted((name, value) for name, value in parse_qsl(parts.query) if name != 'page' and value)
+    return f"{category}:{parts.path}?{urlencode(params)}"
+
+class IncrementalRun:
+    # The searches are ordered by price, not by date, so a page of known listings
+    # says nothing about the pages after it. An incremental run reads every result
+    # page and only skips the ad pages of unchanged listings.
+    def __init__(self, key):
+        self.key = key
+        self.started = time.time()
+        with _lock:
+            rows = get_connection().execute('SELECT url, price FROM seen_listings WHERE search_key = ?', (key,)).fetchall()
+        self.known = dict(rows)
+        self.seen = {}
+        self.new = set()
+        self.changed = {}
+        self.new_records = []
+        self.changed_records = []
+
+    def classify(self, href, price):
+        # Returns True if the ad page has to be fetched (new listing or new price)
+        self.seen[href] = price
+        if href not in self.known:
+            self.new.add(href)
+        elif self.known[href] != price:
+            self.changed[href] = self.known[href]
+        else:
+            return False
+        return True
+
+    def fetch_failed(self, href):
+        # The ad page of a new or changed listing could not be read. The listing
+        # keeps the price of the last run, or is left out if it is new, so the
+        # next run fetches it again
+        if href in self.known:
+            self.seen[href] = self.known[href]
+        else:
+            self.seen.pop(href, None)
+        self.new.discard(href)
+        self.changed.pop(href, None)
+
+    def collect(self, record):
+        # record is a scraped listing as written to the outputs
+        if record['Link'] in self.new:
+            self.new_records.append(record)
+        elif record['Link'] in self.changed:
+            self.changed_records.append(dict(record, **{'Previous Price': self.changed[record['Link']]}))
+
+    def finish(self, complete):
+        # Listings missing from this run only count as disappeared if the whole
+        # search was crawled
+        now = time.time()
+        disappeared = {url: price for url, price in self.known.items() if url not in self.seen} if complete else {}
+        with _lock:
+            conn = get_connection()
+            with conn:
+                conn.executemany(
+                    'INSERT INTO seen_listings (search_key, url, price, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT (search_key, url) DO UPDATE SET price = excluded.price, last_seen = excluded.last_seen',
+                    [(self.key, url, price, now, now) for url, price in self.seen.items()])
+                conn.executemany('DELETE FROM seen_listings WHERE search_key = ? AND url = ?',
+                                 [(self.key, url) for url in disappeared])
+        return {
+            'search': self.key,
+            'new': self.new_records,
+            'changed': self.changed_records,
+            'disappeared': [{'Link': url, 'Price': price} for url, price in disappeared.items()],
+        }
+
+def known_urls(key):
+    with _lock:
+        rows = get_connection().execute('SELECT url FROM seen_listings WHERE search_key = ?', (key,)).fetchall()
+    return {url for url, in rows}
+
+def remember(key, prices):
+    # prices maps listing URLs to the price they were seen with
+    now = time.time()
+    with _lock:
+        conn = get_connection()
+        with conn:
+            conn.executemany(
+                'INSERT INTO seen_listings (search_key, url, price, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (search_key, url) DO UPDATE SET price = excluded.price, last_seen = excluded.last_seen',
+                [(key, url, price, now, now) for url, price in prices.items()])
+
+def is_primed(key):
+    with _lock:
+        return get_connection().execute('SELECT 1 FROM primed_searches WHERE search_key = ?', (key,)).fetchone() is not None
+
+def mark_primed(key):
+    with _lock:
+        conn = get_connection()
+        with conn:
+            conn.execute('INSERT OR IGNORE INTO primed_searches (search_key, primed_at) VALUES (?, ?)', (key, time.time()))
+
+def print_delta(delta):
+    print(f"\nIncremental run: {len(delta['new'])} new, {len(delta['changed'])} changed, "
+          f"{len(delta['disappeared'])} disappeared listings")
+
+def write_delta(delta, json_file):
+    try:
+        with open(json_file, mode='w', encoding='utf-8') as file:
+            json.dump(delta, file, ensure_ascii=False, indent=4)
+        print(f"Changes since the last run have been written to {json_file}")
+    except IOError as e:
+        print(f"Failed to write JSON file. Error: {e}")
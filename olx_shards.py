@@ -0,0 +1,57 @@
+from collections import namedtuple
+
+import olx_fetch
+from olx_fetch import map_in_order
+
+# OLX never shows more than this many result pages for one search
+page_cap = 25
+# First split of a search by price; the last range is open-ended
+initial_bounds = [0, 1000, 2500, 5000, 10000, 20000, 50000]
+
+# A price range of a search with its page count and its already fetched page 1
+Shard = namedtuple('Shard', ['price_from', 'price_to', 'total_pages', 'response'])
+
+def initial_ranges(bounds=None):
+    bounds = bounds or initial_bounds
+    # Neighbouring ranges share their boundary so no price falls between them;
+    # listings priced exactly on it are removed by deduplication
+    ranges = list(zip(bounds, bounds[1:]))
+    ranges.append((bounds[-1], None))
+    return ranges
+
+def split_range(price_from, price_to):
+    if price_to is None:
+        middle = max(price_from * 2, price_from + 1000)
+        return [(price_from, middle), (middle, None)]
+    if price_to - price_from < 2:
+        return None
+    middle = (price_from + price_to) // 2
+    return [(price_from, middle), (middle, price_to)]
+
+def plan_shards(probe, bounds=None, cap=None):
+    # probe(price_from, price_to) fetches page 1 of a range and returns
+    # (total_pages, response), or None if it failed; ranges still at the page cap
+    # are split in two. Returns None if any probe failed, as the plan would miss
+    # that range
+    if cap is None:
+        cap = page_cap
+    shards = []
+    pending = initial_ranges(bounds)
+    while pending:
+        probed = map_in_order(lambda price_range: probe(*price_range), pending, olx_fetch.parallel_searches)
+        ranges, pending = pending, []
+        if any(result is None for result in probed):
+            return None
+        for (price_from, price_to), (total_pages, response) in zip(ranges, probed):
+            halves = split_range(price_from, price_to) if total_pages >= cap else None
+            if halves:
+                pending.extend(halves)
+            elif total_pages:
+                shards.append(Shard(price_from, price_to, total_pages, response))
+    shards.sort(key=lambda shard: shard.price_from)
+    return shards
+
+def describe(shard):
+    if shard.price_to is None:
+        return f"{shard.price_from}+"
+    return f"{shard.price_from}-{shard.price_to}"
@@ -0,0 +1,221 @@
+import argparse
+import math
+import sqlite3
+import threading
+import time
+
+from olx_filters import price_value
+from olx_output import parse_formats, open_sinks, write_record, close_sinks
+
+# Every listing the scrapers have seen, one row per ad URL, with its price
+# changes. The car and motorcycle scrapers collect a run's listings here instead
+# of in a spool file, so their sorted CSV/JSON outputs are a query over the store.
+enabled = True
+store_path = 'olx_listings.sqlite3'
+# Listings buffered before they are written in one transaction
+batch_size = 500
+
+_conn = None
+_lock = threading.Lock()
+
+def get_connection():
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(store_path, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS listings (
+                url TEXT PRIMARY KEY,
+                category TEXT NOT NULL,
+                price_text TEXT NOT NULL,
+                price REAL,
+                location TEXT COLLATE NOCASE,
+                description TEXT,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS listings_category_price ON listings (category, price);
+            CREATE INDEX IF NOT EXISTS listings_price ON listings (price);
+            CREATE INDEX IF NOT EXISTS listings_location ON listings (location);
+            CREATE INDEX IF NOT EXISTS listings_first_seen ON listings (first_seen);
+            CREATE INDEX IF NOT EXISTS listings_last_seen ON listings (last_seen);
+            CREATE TABLE IF NOT EXISTS price_history (
+                url TEXT NOT NULL,
+                price_text TEXT NOT NULL,
+                price REAL,
+                seen_at REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS price_history_url ON price_history (url, seen_at);
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                category TEXT NOT NULL,
+                search_key TEXT NOT NULL,
+                started REAL NOT NULL,
+                finished REAL,
+                listings INTEGER NOT NULL DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS runs_search_key ON runs (search_key, started);
+            -- The listings each run returned; runs of the same search, e.g. with
+            -- different filters in one batch, each keep their own
+            CREATE TABLE IF NOT EXISTS run_listings (
+                run_id INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                PRIMARY KEY (run_id, url));
+        ''')
+        _conn = conn
+    return _conn
+
+def _number(price_number):
+    # inf is what price_to_number returns for a price it cannot read
+    return None if price_number is None or math.isinf(price_number) else price_number
+
+class ListingStore:
+    # Collects the listings of one run of a search. write() takes the
+    # (price_number, price, link, location, description) tuples the car and
+    # motorcycle scrapers spool, so it can stand in for the spool; it is safe to
+    # share between threads.
+    def __init__(self, category, search_key):
+        self.category = category
+        self.search_key = search_key
+        self.pending = []
+        self.written = 0
+        self.lock = threading.Lock()
+        with _lock:
+            self.run_id = get_connection().execute(
+                'INSERT INTO runs (category, search_key, started) VALUES (?, ?, ?)',
+                (category, search_key, time.time())).lastrowid
+
+    def add(self, price, link, location, description, price_number=None):
+        if price_number is None:
+            price_number = price_value(price)
+        self.write((price_number, price, link, location, description))
+
+    def write(self, listing):
+        with self.lock:
+            self.pending.append(listing)
+            full = len(self.pending) >= batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            listings, self.pending = self.pending, []
+        if not listings:
+            return
+        now = time.time()
+        rows = [(link, self.category, price, _number(price_number), location, description, now, now)
+                for price_number, price, link, location, description in listings]
+        with _lock:
+            conn = get_connection()
+            conn.execute('BEGIN')
+            try:
+                # A price goes into the history when the listing is new or its price changed
+                conn.executemany(
+                    'INSERT INTO price_history (url, price_text, price, seen_at) '
+                    'SELECT ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM listings WHERE url = ? AND price_text = ?)',
+                    [(row[0], row[2], row[3], now, row[0], row[2]) for row in rows])
+                conn.executemany(
+                    'INSERT INTO listings (url, category, price_text, price, location, description, first_seen, last_seen) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (url) DO UPDATE SET category = excluded.category, price_text = excluded.price_text, '
+                    'price = excluded.price, location = excluded.location, description = excluded.description, '
+                    'last_seen = excluded.last_seen', rows)
+                conn.executemany('INSERT OR IGNORE INTO run_listings (run_id, url) VALUES (?, ?)',
+                                 [(self.run_id, row[0]) for row in rows])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        self.written += len(rows)
+
+    def close(self):
+        self.flush()
+        with _lock:
+            get_connection().execute('UPDATE runs SET finished = ?, listings = ? WHERE id = ?',
+                                     (time.time(), self.written, self.run_id))
+
+    def results(self):
+        # The listings of this run in the order the spool sort gives them:
+        # cheapest first, unreadable prices last
+        with _lock:
+            rows = get_connection().execute(
+                'SELECT l.price, l.price_text, l.url, l.location, l.description '
+                'FROM run_listings r JOIN listings l ON l.url = r.url '
+                'WHERE r.run_id = ? '
+                'ORDER BY l.price IS NULL, l.price, l.price_text, l.url, l.location COLLATE BINARY, l.description',
+                (self.run_id,)).fetchall()
+        for price_number, price, link, location, description in rows:
+            yield (float('inf') if price_number is None else price_number), price, link, location, description
+
+def query(category=None, min_price=None, max_price=None, location=None, seen_since=None, limit=None):
+    # Cheapest first; location matches the start of the location, e.g. the city
+    conditions, params = [], []
+    if category:
+        conditions.append('category = ?')
+        params.append(category)
+    if min_price is not None:
+        conditions.append('price >= ?')
+        params.append(min_price)
+    if max_price is not None:
+        conditions.append('price <= ?')
+        params.append(max_price)
+    if location:
+        conditions.append('location LIKE ?')
+        params.append(location.replace('%', '').replace('_', '') + '%')
+    if seen_since is not None:
+        conditions.append('last_seen >= ?')
+        params.append(seen_since)
+    sql = 'SELECT url, price_text, location, description, category, price FROM listings'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY price IS NULL, price, url'
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    with _lock:
+        return get_connection().execute(sql, params).fetchall()
+
+def price_history(url):
+    with _lock:
+        return get_connection().execute(
+            'SELECT seen_at, price_text FROM price_history WHERE url = ? ORDER BY seen_at', (url,)).fetchall()
+
+def close():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query the listings stored by the OLX scrapers.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    search = commands.add_parser('query', help='listings matching the filters, cheapest first')
+    search.add_argument('--category', choices=('car', 'motorcycle', 'bike'))
+    search.add_argument('--min-price', type=float)
+    search.add_argument('--max-price', type=float)
+    search.add_argument('--location', help='start of the location, e.g. Lisboa')
+    search.add_argument('--days', type=float, help='only listings seen in the last DAYS days')
+    search.add_argument('--limit', type=int)
+    search.add_argument('--formats', default='', help='csv, json, ndjson or both; prints a table if empty')
+    search.add_argument('--output', default='listings', help='output file name without extension (default: %(default)s)')
+    history = commands.add_parser('history', help='price changes of one listing')
+    history.add_argument('url')
+    args = parser.parse_args(argv)
+
+    if args.command == 'history':
+        for seen_at, price in price_history(args.url):
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(seen_at))}  {price}")
+        return
+    seen_since = time.time() - args.days * 24 * 60 * 60 if args.days else None
+    rows = query(args.category, args.min_price, args.max_price, args.location, seen_since, args.limit)
+    formats = parse_formats(args.formats)
+    if not formats:
+        for url, price, location, _, category, _ in rows:
+            print(f"{price:>12}  {category:<10}  {location or '':<30}  {url}")
+        print(f"{len(rows)} listings")
+        return
+    sinks = open_sinks(args.output, formats)
+    for index, (url, price, location, description, _, _) in enumerate(rows, start=1):
+        write_record(sinks, {'Index': index, 'Link': url, 'Price': price, 'Location': location, 'Description': description})
+    close_sinks(sinks)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Per host limit on requests in flight, adjusted by additive increase /
+# multiplicative decrease: it grows by one after a full window of healthy
+# responses and is cut on 429s, 5xx errors, connection errors and latency spikes.
+# A token bucket caps the request rate on top of that.
+
+initial_concurrency = 8
+min_concurrency = 1
+max_concurrency = 32
+# The limit is multiplied by this on a throttled or failed request
+decrease_factor = 0.5
+# At most one decrease per this many seconds, so one burst of errors cuts the limit once
+decrease_cooldown = 1.0
+# A response is a latency spike if it took this many times the usual latency,
+# and at least latency_floor seconds
+latency_spike_factor = 3.0
+latency_floor = 0.5
+# Weight of the newest response in the usual latency
+latency_smoothing = 0.1
+# Requests per second per host; 0 disables the ceiling
+rate_limit = 20.0
+
+logger = logging.getLogger('olx_throttle')
+# Decreases are logged as warnings, increases only when verbose, e.g. OLX_VERBOSE=1
+verbose = os.environ.get('OLX_VERBOSE', '') not in ('', '0')
+
+_controllers = {}
+_lock = threading.Lock()
+
+class HostController:
+    def __init__(self, host):
+        self.host = host
+        self.cond = threading.Condition()
+        self.limit = float(initial_concurrency)
+        self.in_flight = 0
+        self.successes = 0
+        self.latency = None
+        self.last_decrease = 0.0
+        self.rate = rate_limit
+        self.tokens = max(1.0, rate_limit)
+        self.refilled = time.monotonic()
+        self.increases = 0
+        self.decreases = 0
+        self.rate_wait = 0.0
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+        self._take_token()
+
+    def _take_token(self):
+        if not self.rate:
+            return
+        while True:
+            with self.cond:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.refilled) * self.rate)
+                self.refilled = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+                self.rate_wait += delay
+            time.sleep(delay)
+
+    def release(self, elapsed, status=None):
+        # status is the HTTP status, or None if the request failed without a response
+        with self.cond:
+            # Only a window that is actually filled has earned a bigger one
+            window_full = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if status is None or status == 429 or status >= 500:
+                self._decrease(f"status {status}" if status else 'connection error')
+            elif self.latency is not None and elapsed > max(latency_floor, latency_spike_factor * self.latency):
+                self._decrease(f"latency {elapsed:.2f}s, usual {self.latency:.2f}s")
+            else:
+                self.latency = elapsed if self.latency is None else \
+                    (1 - latency_smoothing) * self.latency + latency_smoothing * elapsed
+                self.successes += 1
+                # One step up per window of healthy responses, i.e. per round trip of the whole window
+                if self.successes >= int(self.limit) and window_full and self.limit < max_concurrency:
+                    self.limit += 1
+                    self.successes = 0
+                    self.increases += 1
+                    logger.info("%s: concurrency %d -> %d", self.host, self.limit - 1, self.limit)
+            self.cond.notify_all()
+
+    def cancel(self):
+        # For attempts that ended in an error unrelated to the server
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def _decrease(self, reason):
+        self.successes = 0
+        now = time.monotonic()
+        if now - self.last_decrease < decrease_cooldown:
+            return
+        self.last_decrease = now
+        old = self.limit
+        self.limit = max(float(min_concurrency), self.limit * decrease_factor)
+        self.decreases += 1
+        logger.warning("%s: %s, concurrency %d -> %d", self.host, reason, old, self.limit)
+
+def configure_logging(verbose_logs=False):
+    level = logging.INFO if verbose_logs or verbose else logging.WARNING
+    logging.basicConfig(level=level, format='%(name)s: %(message)s')
+
+def for_url(url):
+    host = urlsplit(url).netloc
+    with _lock:
+        controller = _controllers.get(host)
+        if controller is None:
+            controller = _controllers[host] = HostController(host)
+    return controller
+
+def stats():
+    with _lock:
+        controllers = list(_controllers.values())
+    return {controller.host: {
+        'concurrency': int(controller.limit),
+        'increases': controller.increases,
+        'decreases': controller.decreases,
+        'rate_wait': controller.rate_wait,
+    } for controller in controllers}
+
+def print_stats():
+    for host, result in stats().items():
+        print(f"Throttle {host}: concurrency limit {result['concurrency']}, {result['increases']} increases, "
+              f"{result['decreases']} decreases, {result['rate_wait']:.1f}s waited for the rate limit (summed over threads)")
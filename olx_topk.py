@@ -0,0 +1,58 @@
+import heapq
+
+class _Largest:
+    # Inverts the ordering so heapq keeps the most expensive listing on top
+    __slots__ = ('listing',)
+
+    def __init__(self, listing):
+        self.listing = listing
+
+    def __lt__(self, other):
+        return other.listing < self.listing
+
+class TopK:
+    # Keeps the k cheapest (price_number, ...) listings of a price ordered search
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+        self.page_min = None
+        # Prices of the cards let through on the current page, which only reach
+        # the heap once the whole page has been fetched
+        self.admitted = []
+        self.skipped = 0
+
+    def full(self):
+        return len(self.heap) >= self.k
+
+    def worst_price(self):
+        return self.heap[0].listing[0] if self.full() else float('inf')
+
+    def can_enter(self, price_number):
+        # Called for every card; cards that cannot make the cut are not fetched.
+        # Every card let through is counted against the k places, as the car and
+        # motorcycle searches have no rule that drops a listing after its ad page
+        if self.page_min is None or price_number < self.page_min:
+            self.page_min = price_number
+        prices = [item.listing[0] for item in self.heap] + self.admitted
+        if len(prices) >= self.k and heapq.nsmallest(self.k, prices)[-1] < price_number:
+            self.skipped += 1
+            return False
+        self.admitted.append(price_number)
+        return True
+
+    def add(self, listing):
+        if not self.full():
+            heapq.heappush(self.heap, _Largest(listing))
+        elif listing < self.heap[0].listing:
+            heapq.heapreplace(self.heap, _Largest(listing))
+
+    def end_page(self):
+        # True once no card on the page that was just scraped could enter,
+        # so later pages, which are more expensive, cannot either
+        cheapest = self.page_min
+        self.page_min = None
+        self.admitted = []
+        return cheapest is not None and self.full() and cheapest > self.worst_price()
+
+    def results(self):
+        return sorted(item.listing for item in self.heap)
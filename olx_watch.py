@@ -0,0 +1,289 @@
+import argparse
+import json
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit
+
+import requests
+
+import olx_http
+import olx_throttle
+import olx_metrics
+import olx_cache
+import olx_seen
+import olx_pipeline
+from olx_fetch import map_in_order
+from olx_output import NdjsonSink
+import olx_car_scrapper
+import olx_motorcycle_scrapper
+import olx_bike_scrapper
+
+# Watches one search for new ads: polls its newest-first result page, stops at
+# the first listing seen before and only fetches the ad pages of new listings.
+# Listings already seen are kept in olx_seen, so a restart does not report them again.
+
+# Seconds between two polls
+poll_interval = 60
+# Each wait is poll_interval times a random factor between 1 - poll_jitter and 1 + poll_jitter
+poll_jitter = 0.2
+# Result pages read in one poll when every listing on them is new
+max_pages = 3
+# Known listings in a row that end a poll; raise it if promoted ads are pinned to the top
+known_to_stop = 1
+# Seconds to wait for a webhook to accept a listing
+webhook_timeout = 10
+
+scrapers = {'car': olx_car_scrapper, 'motorcycle': olx_motorcycle_scrapper, 'bike': olx_bike_scrapper}
+
+def newest_first(url, page=1):
+    parts = urlsplit(url)
+    params = [(name, value) for name, value in parse_qsl(parts.query) if name not in ('page', 'search[order]')]
+    params.append(('search[order]', 'created_at:desc'))
+    if page > 1:
+        params.append(('page', page))
+    return parts._replace(query=urlencode(params)).geturl()
+
+class StdoutSink:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, record):
+        self.stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.flush()
+
+class DeliveryError(Exception):
+    pass
+
+class WebhookSink:
+    # POSTs every new listing as a JSON object; a listing that cannot be
+    # delivered raises DeliveryError, so the watcher sends it again on the next poll
+    def __init__(self, url):
+        self.url = url
+        self.failures = 0
+
+    def write(self, record):
+        try:
+            response = olx_http.get_session().post(self.url, json=record, timeout=webhook_timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            self.failures += 1
+            raise DeliveryError(f"Failed to send {record['Link']} to {self.url}: {e}")
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+def open_sink(target, stdout):
+    # '-' writes NDJSON to stdout, an http(s) URL is a webhook, anything else is a file appended to
+    if target == '-':
+        return StdoutSink(stdout)
+    if target.startswith(('http://', 'https://')):
+        return WebhookSink(target)
+    return NdjsonSink(target, announce=False, mode='a')
+
+class Watcher:
+    def __init__(self, category, url, filters, sink, stop_after=None):
+        self.scraper = scrapers[category]
+        self.url = newest_first(url)
+        self.key = olx_seen.search_key(category, self.url)
+        self.known = olx_seen.known_urls(self.key)
+        # The first poll of a search never watched before only records what is there,
+        # even if that is nothing
+        self.primed = bool(self.known) or olx_seen.is_primed(self.key)
+        self.filters = filters
+        self.sink = sink
+        self.stop_after = max(1, stop_after or known_to_stop)
+        self.validators = {}
+        self.polls = 0
+        self.found = 0
+
+    def fetch_page(self, page):
+        # Page 1 is requested conditionally, so an unchanged search costs a 304
+        headers = self.validators if page == 1 else {}
+        with olx_metrics.span('result_page_fetch'):
+            response = olx_http.get(newest_first(self.url, page), headers=headers)
+        if page == 1 and response.status_code == 200:
+            self.validators = {}
+            if response.headers.get('ETag'):
+                self.validators['If-None-Match'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                self.validators['If-Modified-Since'] = response.headers['Last-Modified']
+        return response
+
+    def new_cards(self):
+        # Returns (price, href, location, title) of the listings not seen before, newest
+        # first, or None if page 1 could not be read
+        fresh = []
+        fresh_urls = set()
+        known_in_a_row = 0
+        for page in range(1, max_pages + 1):
+            response = self.fetch_page(page)
+            if response.status_code == 304:
+                return fresh
+            if response.status_code != 200:
+                print(f"Failed to retrieve page {page} of {self.url}. Status code: {response.status_code}")
+                return fresh if page > 1 else None
+            cards = olx_pipeline.parse_cards(response)
+            fresh_before = len(fresh)
+            for ad in cards:
+                if not ad.href:
+                    continue
+                href = urljoin(self.scraper.ad_base_url, ad.href)
+                # Ads posted while this poll runs push listings already read onto the next page
+                if href in fresh_urls:
+                    continue
+                if href in self.known:
+                    known_in_a_row += 1
+                    if known_in_a_row >= self.stop_after:
+                        return fresh
+                    continue
+                known_in_a_row = 0
+                price = ad.price if ad.price is not None else 'Price not found'
+                location = self.scraper.format_location(ad.location) if ad.location is not None else 'Location not found'
+                fresh.append((price, href, location, ad.title))
+                fresh_urls.add(href)
+            # A page without new listings, e.g. the last page repeated, ends the poll too
+            if len(fresh) == fresh_before or not self.primed:
+                break
+        return fresh
+
+    @olx_metrics.timed('poll')
+    def poll(self):
+        # Returns the number of new listings sent to the sink
+        self.polls += 1
+        cards = self.new_cards()
+        if cards is None:
+            return 0
+        if not self.primed:
+            self.remember(cards)
+            olx_seen.mark_primed(self.key)
+            self.primed = True
+            print(f"Watching {self.url}: {len(cards)} current listings marked as seen")
+            return 0
+
+        # A listing is only remembered once it has been handed to the sink or
+        # filtered out, so one whose ad page or delivery failed is tried again on
+        # the next poll. fetch_description returns None for a failed ad page.
+        kept = [card for card in cards if self.filters.accept_card(card[0], card[2], card[3])]
+        self.remember([card for card in cards if card not in kept])
+        descriptions = map_in_order(self.scraper.fetch_description, [card[1] for card in kept])
+        found_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        found = 0
+        # Oldest first, so the sink receives the listings in the order they were posted
+        for card, description in reversed(list(zip(kept, descriptions))):
+            if description is None:
+                continue
+            price, href, location, title = card
+            if self.filters.accept_description(description):
+                try:
+                    self.sink.write({'Link': href, 'Price': price, 'Location': location, 'Title': title,
+                                     'Description': description, 'Found At': found_at})
+                except DeliveryError as e:
+                    # The rest waits for the next poll too, so the sink keeps getting them in order
+                    print(e)
+                    break
+                found += 1
+            self.remember([card])
+        self.sink.flush()
+        self.found += found
+        return found
+
+    def remember(self, cards):
+        self.known.update(card[1] for card in cards)
+        olx_seen.remember(self.key, {href: price for price, href, _, _ in cards})
+
+def next_delay(interval=None, jitter=None):
+    interval = poll_interval if interval is None else interval
+    jitter = poll_jitter if jitter is None else jitter
+    return max(0.0, interval * random.uniform(1 - jitter, 1 + jitter))
+
+def watch(watcher, interval=None, jitter=None, polls=None):
+    # Polls until polls polls are done (forever if None) or until interrupted
+    try:
+        while True:
+            try:
+                found = watcher.poll()
+            except requests.exceptions.RequestException as e:
+                print(f"Poll {watcher.polls} failed: {e}")
+            else:
+                if found:
+                    print(f"Poll {watcher.polls}: {found} new listings")
+            # Keeps the Prometheus textfile current while the watch runs
+            olx_metrics.export(announce=False)
+            if polls is not None and watcher.polls >= polls:
+                break
+            time.sleep(next_delay(interval, jitter))
+    except KeyboardInterrupt:
+        pass
+
+def search_url(category, brand='', model='', year_from='', year_to='', min_price='', max_price=''):
+    if category == 'car':
+        return olx_car_scrapper.build_url(brand, 1, model, year_from, year_to)
+    if category == 'motorcycle':
+        return olx_motorcycle_scrapper.build_url(brand, 1, model, year_from, year_to)
+    return olx_bike_scrapper.build_url(1, min_price, max_price)
+
+def make_filters(category, min_price='', max_price='', location=''):
+    if category == 'bike':
+        return olx_bike_scrapper.make_filters(min_price, max_price)
+    return scrapers[category].make_filters(min_price, max_price, location)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Watch an OLX search and report new listings as they are posted.')
+    parser.add_argument('category', choices=sorted(scrapers))
+    parser.add_argument('--brand', default='', help='brand (car and motorcycle searches)')
+    parser.add_argument('--model', default='')
+    parser.add_argument('--year-from', default='')
+    parser.add_argument('--year-to', default='')
+    parser.add_argument('--min-price', default='')
+    parser.add_argument('--max-price', default='')
+    parser.add_argument('--location', default='', help='only report listings whose location contains this')
+    parser.add_argument('--interval', type=float, default=poll_interval, help='seconds between polls (default: %(default)s)')
+    parser.add_argument('--jitter', type=float, default=poll_jitter, help='random spread of the interval (default: %(default)s)')
+    parser.add_argument('--known-to-stop', type=int, default=known_to_stop, help='known listings in a row that end a poll (default: %(default)s)')
+    parser.add_argument('--polls', type=int, help='stop after this many polls (default: run until interrupted)')
+    parser.add_argument('--sink', default='-', help="'-' for NDJSON on stdout, a file to append NDJSON to, or a webhook URL")
+    parser.add_argument('--base-url', help='result pages URL to use instead of the OLX one, e.g. a local test server')
+    parser.add_argument('--ad-base-url', help='URL the ad links are relative to')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every throttle decision')
+    args = parser.parse_args(argv)
+    olx_throttle.configure_logging(args.verbose)
+
+    if args.category != 'bike' and not args.brand:
+        parser.error(f"{args.category} searches need --brand")
+    scraper = scrapers[args.category]
+    if args.base_url:
+        scraper.base_url = args.base_url
+    if args.ad_base_url:
+        scraper.ad_base_url = args.ad_base_url
+
+    # Status messages go to stderr, so stdout only carries the listings
+    stdout = sys.stdout
+    with redirect_stdout(sys.stderr):
+        sink = open_sink(args.sink, stdout)
+        url = search_url(args.category, args.brand.lower().strip(), args.model, args.year_from, args.year_to, args.min_price, args.max_price)
+        watcher = Watcher(args.category, url, make_filters(args.category, args.min_price, args.max_price, args.location), sink, args.known_to_stop)
+        watch(watcher, args.interval, args.jitter, args.polls)
+        sink.close()
+        print(f"\n{watcher.polls} polls, {watcher.found} new listings")
+        watcher.filters.print_stats()
+        olx_http.print_stats()
+        olx_throttle.print_stats()
+        olx_cache.print_stats()
+        olx_metrics.print_stats()
+        olx_metrics.export()
+        olx_cache.close()
+
+if __name__ == "__main__":
+    with olx_metrics.profile():
+        main()